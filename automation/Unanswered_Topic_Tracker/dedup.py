@@ -0,0 +1,79 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# cosine similarity 大於此值視為同一個問題
+SIMILARITY_THRESHOLD = getattr(settings, 'UTT_DEDUP_THRESHOLD', 0.9)
+# 一次算多少列的相似度矩陣，限制記憶體用量（block_size x n 個 float32）
+BLOCK_SIZE = getattr(settings, 'UTT_DEDUP_BLOCK_SIZE', 1024)
+# 問題數超過此值且有安裝 faiss 時，改用近似最近鄰（只比較每個問題最像的 ANN_NEIGHBOURS 個）
+ANN_MIN_SIZE = getattr(settings, 'UTT_DEDUP_ANN_MIN_SIZE', 50000)
+ANN_NEIGHBOURS = getattr(settings, 'UTT_DEDUP_ANN_NEIGHBOURS', 32)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _dedup_exact(vectors, threshold, block_size):
+    n = len(vectors)
+    removed = np.zeros(n, dtype=bool)
+    kept = []
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        # 這個 block 的每一列對後面所有問題的相似度，一次矩陣乘法算完，只留下 j > i 且超過門檻的配對
+        rows, cols = np.nonzero(vectors[start:end] @ vectors[start:].T > threshold)
+        rows += start
+        cols += start
+        later = cols > rows
+        rows, cols = rows[later], cols[later]
+        # np.nonzero 依列排序，bounds[k]:bounds[k+1] 就是第 start+k 列的配對
+        bounds = np.searchsorted(rows, np.arange(start, end + 1))
+        for i in range(start, end):
+            if removed[i]:
+                continue
+            kept.append(i)
+            removed[cols[bounds[i - start]:bounds[i - start + 1]]] = True
+    return kept
+
+
+def _dedup_ann(vectors, threshold, neighbours):
+    import faiss
+
+    index = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    index.add(vectors)
+    sims, ids = index.search(vectors, min(neighbours, len(vectors)))
+    removed = np.zeros(len(vectors), dtype=bool)
+    kept = []
+    for i in range(len(vectors)):
+        if removed[i]:
+            continue
+        kept.append(i)
+        later = (ids[i] > i) & (sims[i] > threshold)
+        removed[ids[i][later]] = True
+    return kept
+
+
+def dedup_indices(vectors, threshold=None):
+    """
+    Greedy semantic dedup: walk the questions in order, keep a question unless an earlier kept
+    question has cosine similarity > threshold with it. Same result as the former pairwise
+    cos_sim loop, computed with blocked matrix multiplication (or an ANN index for huge inputs).
+    :param vectors: (n, dim) embeddings, normalized or not
+    :return: list of kept indices, in input order
+    """
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    if len(vectors) == 0:
+        return []
+    vectors = normalize(vectors)
+    if len(vectors) >= ANN_MIN_SIZE:
+        try:
+            return _dedup_ann(vectors, threshold, ANN_NEIGHBOURS)
+        except ImportError:
+            logger.info("faiss is not installed, using exact dedup")
+    return _dedup_exact(vectors, threshold, BLOCK_SIZE)
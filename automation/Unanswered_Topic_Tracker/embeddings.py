@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 問題去重用的句向量模型，每個 worker process 只載入一次
+EMBEDDING_MODEL_NAME = getattr(settings, 'UTT_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+# 每個 process 的 torch CPU thread 數；prefork 有多個 child，每個都用全部核心會互搶，所以預設 1
+# 設成 None 代表用 torch 預設（通常是所有核心），適合只跑 UTT 任務、concurrency 很小的專用 worker
+EMBEDDING_THREADS = getattr(settings, 'UTT_EMBEDDING_THREADS', 1)
+# worker process 啟動時先載入模型並跑一次 encode，第一個任務就不用等。
+# 預設關閉：共用 worker 的每個 prefork child（包括只跑 reminders 的）都會載入 torch，記憶體乘上 concurrency；
+# 只在有專門跑 UTT 任務的 worker 上打開
+EMBEDDING_WARMUP = getattr(settings, 'UTT_EMBEDDING_WARMUP', False)
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Return the SentenceTransformer shared by every task in this process, loading it on first use.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start = time.perf_counter()
+                # 只有真的要算向量時才 import，web process 不用付這個成本
+                import torch
+                from sentence_transformers import SentenceTransformer
+
+                if EMBEDDING_THREADS:
+                    torch.set_num_threads(EMBEDDING_THREADS)
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+                logger.info(f"🧠 Loaded embedding model {EMBEDDING_MODEL_NAME} in {time.perf_counter() - start:.2f}s")
+    return _model
+
+
+def encode(texts):
+    """
+    Encode texts with the shared model.
+    :return: float32 numpy array of shape (len(texts), dim), L2-normalized
+    """
+    return get_model().encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+
+
+def warm_up():
+    """
+    Load the model and run one encode so the first real task does not pay for lazy initialisation.
+    """
+    start = time.perf_counter()
+    encode(["warm up"])
+    logger.info(f"🔥 Embedding model warmed up in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from Unanswered_Topic_Tracker import embeddings
+
+_WORDS = (
+    "build release firmware switch nebula vlan port config sync cloud license upgrade test report "
+    "schedule owner review merge branch ticket customer issue log crash timeout api dashboard"
+).split()
+
+
+def _questions(rng, n):
+    return [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 16))) + "?" for _ in range(n)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the embedding step of run_analysis_task when the SentenceTransformer is created per task "
+        "(old behaviour) vs shared per worker process (first run vs steady state)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", type=int, default=200, help="questions encoded per simulated task run")
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        runs = [_questions(rng, options["questions"]) for _ in range(options["runs"])]
+
+        # shared 先跑，第一輪包含 import torch / sentence_transformers 與模型載入
+        shared = []
+        for questions in runs:
+            start = time.perf_counter()
+            embeddings.encode(questions)
+            shared.append(time.perf_counter() - start)
+
+        from sentence_transformers import SentenceTransformer
+        per_task = []
+        for questions in runs:
+            start = time.perf_counter()
+            SentenceTransformer(embeddings.EMBEDDING_MODEL_NAME, device="cpu").encode(questions, convert_to_tensor=True)
+            per_task.append(time.perf_counter() - start)
+
+        self.stdout.write(
+            f"{embeddings.EMBEDDING_MODEL_NAME}, {options['questions']} questions x {options['runs']} runs, "
+            f"threads={embeddings.EMBEDDING_THREADS or 'default'}"
+        )
+        self.stdout.write("  per-task model : " + ", ".join(f"{t * 1000:.0f}" for t in per_task) + " ms")
+        self.stdout.write("  shared model   : " + ", ".join(f"{t * 1000:.0f}" for t in shared) + " ms")
+        if len(shared) > 1:
+            steady = sorted(shared[1:])[len(shared[1:]) // 2]
+            self.stdout.write(f"  first run {shared[0] * 1000:.0f} ms, steady state (median) {steady * 1000:.0f} ms")
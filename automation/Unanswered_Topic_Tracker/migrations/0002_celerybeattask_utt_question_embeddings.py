@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Unanswered_Topic_Tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerybeattask_utt',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='celerybeattask_utt',
+            name='result_question_embeddings',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Unanswered_Topic_Tracker', '0002_celerybeattask_utt_question_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerybeattask_utt',
+            name='analyzed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Unanswered_Topic_Tracker', '0003_celerybeattask_utt_analyzed_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerybeattask_utt',
+            name='embedding_dim',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
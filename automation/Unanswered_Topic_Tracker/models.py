@@ -1,4 +1,5 @@
 from django.db import models
+import numpy as np
 
 class CeleryBeatTask_UTT(models.Model):
     celery_beat_task_id = models.AutoField(primary_key=True)
@@ -11,6 +12,12 @@ class CeleryBeatTask_UTT(models.Model):
     frequency_minutes = models.IntegerField(default=60)  # 每幾分鐘跑一次
     is_active = models.BooleanField(default=True)        # 停用任務用
     result_question_ls = models.JSONField(null=True, blank=True)
+    # result_question_ls 每個問題的句向量（float16，依序排列），避免每次重新 encode 歷史問題
+    result_question_embeddings = models.BinaryField(null=True, blank=True, editable=False)
+    embedding_model = models.CharField(max_length=255, blank=True, default="")
+    embedding_dim = models.PositiveIntegerField(null=True, blank=True)
+    # 已經分析到哪一則訊息（ChatMessage.created），下次只分析之後的新訊息
+    analyzed_until = models.DateTimeField(null=True, blank=True)
 
     periodic_task = models.ForeignKey(
         "django_celery_beat.PeriodicTask",
@@ -20,5 +27,32 @@ class CeleryBeatTask_UTT(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def get_question_embeddings(self, model_name, dim=None):
+        """
+        Stored embeddings of result_question_ls as a float32 (n, dim) array, or None when they are
+        missing, were produced by another model or with another dimension (dim, when given), or
+        no longer match the stored questions exactly.
+        """
+        questions = self.result_question_ls or []
+        if not questions or not self.result_question_embeddings or self.embedding_model != model_name:
+            return None
+        if not self.embedding_dim or (dim is not None and self.embedding_dim != dim):
+            return None
+        vectors = np.frombuffer(bytes(self.result_question_embeddings), dtype=np.float16)
+        if vectors.size != len(questions) * self.embedding_dim:
+            return None
+        return vectors.reshape(len(questions), self.embedding_dim).astype(np.float32)
+
+    def set_question_embeddings(self, vectors, model_name):
+        """Store one embedding per result_question_ls entry, in the same order."""
+        vectors = np.asarray(vectors, dtype=np.float16)
+        if len(vectors):
+            self.result_question_embeddings = vectors.tobytes()
+            self.embedding_dim = vectors.shape[1]
+        else:
+            self.result_question_embeddings = None
+            self.embedding_dim = None
+        self.embedding_model = model_name
+
     def __str__(self):
         return f"Task {self.celery_beat_task_id} for chat {self.chat_id}"
@@ -2,10 +2,19 @@ from celery import shared_task
 from core.teams_client import TeamsClient
 from .models import CeleryBeatTask_UTT
 from .utils import UnansweredTopicTrackerUtils
+from . import embeddings
+from .dedup import dedup_indices
 import logging
+import threading
+import time
+import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer, util
+from celery.signals import worker_process_init
+from django.conf import settings
 logger = logging.getLogger(__name__)
+# 每次分析最多幾則新訊息（由舊到新，超過的留到下次執行），以及往前帶幾則已分析過的訊息當上下文
+ANALYSIS_MAX_NEW_MESSAGES = getattr(settings, 'UTT_ANALYSIS_MAX_NEW_MESSAGES', 300)
+ANALYSIS_CONTEXT_MESSAGES = getattr(settings, 'UTT_ANALYSIS_CONTEXT_MESSAGES', 30)
 column_mapping = {
     "question": "問題內容",
     "asker": "提問者",
@@ -13,6 +22,28 @@ column_mapping = {
     "reason": "未回應原因"
 }
 
+@worker_process_init.connect
+def warm_up_embedding_model(**kwargs):
+    # worker_process_init 的 handler 超過幾秒沒回來，celery 會把 process 砍掉，所以在背景載入；
+    # 任務若在載入完成前就來，get_model() 會等同一把 lock
+    if embeddings.EMBEDDING_WARMUP:
+        threading.Thread(target=_warm_up_quietly, daemon=True).start()
+
+def _warm_up_quietly():
+    try:
+        embeddings.warm_up()
+    except Exception as e:
+        logger.warning(f"⚠️ Embedding model warm-up failed, it will be loaded on first use: {e}")
+
+def _encode_questions(questions):
+    if not questions:
+        return np.zeros((0, 0), dtype=np.float32)
+    return embeddings.encode([q["question"] for q in questions])
+
+def _stack(*arrays):
+    arrays = [a for a in arrays if len(a)]
+    return np.vstack(arrays) if arrays else np.zeros((0, 0), dtype=np.float32)
+
 @shared_task
 def run_analysis_task(task_id):
     # now = datetime.now()
@@ -26,38 +57,54 @@ def run_analysis_task(task_id):
         task = CeleryBeatTask_UTT.objects.get(pk=task_id)
         logger.info(f"⏰ 執行分析任務 task_id={task_id}, chat_id={task.chat_id}")
 
-        # 抓取 Teams 對話
+        # 同步 Teams 對話到本地訊息庫（只抓上次同步後的新訊息）
         TC = TeamsClient(task.host_id)
-        chat_data = TC.list_msg_in_chats(task.chat_id)
+        TC.sync_chat_messages(task.chat_id)
         
-        # 分析未回覆問題
+        # 分析未回覆問題：只看上次分析之後的新訊息，加上前面幾則當作判斷回覆的上下文
         UTTU = UnansweredTopicTrackerUtils()
-        question_ls = UTTU.analyze_unanswered_questions(chat_data)
+        window, context_count, cursor = UTTU.load_chat_window(
+            task.chat_id, since=task.analyzed_until, context=ANALYSIS_CONTEXT_MESSAGES, limit=ANALYSIS_MAX_NEW_MESSAGES
+        )
+        if cursor is None and task.result_question_ls is not None:
+            logger.info(f"📭 沒有新訊息，沿用上次結果 task_id={task_id}")
+            return
+        logger.info(
+            f"🪟 分析 {len(window) - context_count} 則新訊息（含 {context_count} 則上下文） task_id={task_id}"
+        )
+        question_ls = []
+        if window:
+            question_ls = UTTU.analyze_unanswered_questions(window, context_count=context_count, raise_errors=True)
+        if cursor is not None:
+            # 只推進到這次實際分析到的最後一則，還沒讀到的新訊息留給下次
+            task.analyzed_until = cursor
 
         if not question_ls:
             logger.info(f"📭 沒有未回應問題，仍建立空 Excel task_id={task_id}")
             # TODO: 從 SharePoint 刪除舊報告（視需求）
+        # 只 encode 這次新找到的問題，歷史問題的向量存在 task 上
+        new_embeddings = _encode_questions(question_ls)
         if task.result_question_ls!=None:
-            model = SentenceTransformer('all-MiniLM-L6-v2')
-            # encode all questions
+            dedup_start = time.perf_counter()
             existing_qs = task.result_question_ls
+            existing_embeddings = task.get_question_embeddings(
+                embeddings.EMBEDDING_MODEL_NAME, dim=new_embeddings.shape[1] if len(new_embeddings) else None
+            )
+            if existing_embeddings is None:
+                # 舊資料沒有向量（或換了模型），補算一次之後就會存起來
+                existing_embeddings = _encode_questions(existing_qs)
             all_questions = existing_qs + question_ls
-            embeddings = model.encode([q["question"] for q in all_questions], convert_to_tensor=True)
+            all_embeddings = _stack(existing_embeddings, new_embeddings)
 
-            # keep unique questions based on semantic similarity
-            unique_questions = []
-            added_indices = set()
-            for i in range(len(all_questions)):
-                if i in added_indices:
-                    continue
-                unique_questions.append(all_questions[i])
-                for j in range(i + 1, len(all_questions)):
-                    if j in added_indices:
-                        continue
-                    sim = util.pytorch_cos_sim(embeddings[i], embeddings[j]).item()
-                    if sim > 0.9:
-                        added_indices.add(j)
-            question_ls = unique_questions
+            # keep unique questions based on semantic similarity（先出現的保留）
+            kept = dedup_indices(all_embeddings)
+            question_ls = [all_questions[i] for i in kept]
+            new_embeddings = all_embeddings[kept]
+            logger.info(
+                f"🧮 Dedup {len(all_questions)} -> {len(question_ls)} questions in "
+                f"{time.perf_counter() - dedup_start:.2f}s task_id={task_id}"
+            )
+        task.set_question_embeddings(new_embeddings, embeddings.EMBEDDING_MODEL_NAME)
         task.result_question_ls = question_ls  # type: ignore
 
         # 建立 DataFrame 並上傳 Excel
@@ -1,3 +1,163 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.test import SimpleTestCase
+import numpy as np
+
+from . import utils
+from .dedup import _dedup_exact, dedup_indices, normalize
+from .utils import UnansweredTopicTrackerUtils
+
+
+def greedy_reference(vectors, threshold):
+    """The former pairwise loop: keep i unless an earlier kept question is more similar than threshold."""
+    vectors = normalize(vectors)
+    removed, kept = set(), []
+    for i in range(len(vectors)):
+        if i in removed:
+            continue
+        kept.append(i)
+        for j in range(i + 1, len(vectors)):
+            if j not in removed and float(vectors[i] @ vectors[j]) > threshold:
+                removed.add(j)
+    return kept
+
+
+def unit(angle_degrees):
+    angle = np.radians(angle_degrees)
+    return [np.cos(angle), np.sin(angle)]
+
 
 # Create your tests here.
+class DedupIndicesTests(SimpleTestCase):
+    def test_empty_input(self):
+        self.assertEqual(dedup_indices(np.zeros((0, 4))), [])
+
+    def test_threshold_boundary(self):
+        # 相似度略低於 0.9 的保留，略高於 0.9 的才視為重複
+        at_threshold = np.degrees(np.arccos(0.9))
+        vectors = np.array([unit(0), unit(at_threshold + 0.01), unit(at_threshold - 0.5)])
+        self.assertEqual(dedup_indices(vectors, threshold=0.9), [0, 1])
+
+    def test_scale_does_not_matter(self):
+        vectors = np.array([[1.0, 0.0], [10.0, 0.1], [0.0, 3.0]])
+        self.assertEqual(dedup_indices(vectors, threshold=0.9), [0, 2])
+
+    def test_removed_questions_do_not_remove_others(self):
+        # A~B、B~C，但 A 與 C 不相似：B 被 A 去掉後，C 仍然保留
+        vectors = np.array([unit(0), unit(20), unit(40)])
+        self.assertEqual(dedup_indices(vectors, threshold=0.9), [0, 2])
+
+    def test_matches_the_pairwise_loop_for_any_block_size(self):
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=(20, 16))
+        vectors = base[rng.integers(0, len(base), 120)] + rng.normal(scale=0.3, size=(120, 16))
+        expected = greedy_reference(vectors, 0.9)
+        self.assertLess(len(expected), len(vectors))
+        self.assertEqual(dedup_indices(vectors, threshold=0.9), expected)
+        for block_size in (1, 7, 64, 1000):
+            self.assertEqual(_dedup_exact(normalize(vectors), 0.9, block_size), expected)
+
+
+def message(i, reply_to=None, text=None):
+    return {
+        "id": f"m{i}",
+        "sender": f"user{i % 3}",
+        "text": text or f"message {i} " + "x" * 36,
+        "timestamp": f"2026-03-10T10:{i // 60:02d}:{i % 60:02d}Z",
+        "reply_to_id": [{"msg_id": f"m{reply_to}", "sender": "someone", "msg_preview": "..."}] if reply_to is not None else None,
+    }
+
+
+def question(text, asker="A", timestamp=""):
+    return {"question": text, "asker": asker, "timestamp": timestamp, "reason": "no reply"}
+
+
+class ChunkMessagesTests(SimpleTestCase):
+    def setUp(self):
+        # chunk_messages / merge 不需要 Gemini，不跑 __init__（會讀 oauth_settings.yml）
+        self.utils = UnansweredTopicTrackerUtils.__new__(UnansweredTopicTrackerUtils)
+        self.line_tokens = utils.estimate_tokens(self.utils._format_dialog_line(message(0))) + 1
+
+    def own_ids(self, chunks):
+        """Message ids analyzed (not context, not follow-up) by each chunk."""
+        return [[m["id"] for m in msgs[context:len(msgs) - followup]] for msgs, context, followup in chunks]
+
+    def test_short_chat_is_one_chunk(self):
+        msgs = [message(i) for i in range(5)]
+        self.assertEqual(self.utils.chunk_messages(msgs, context_count=2), [(msgs, 2, 0)])
+
+    def test_context_only_window_has_no_chunks(self):
+        msgs = [message(i) for i in range(3)]
+        self.assertEqual(self.utils.chunk_messages(msgs, context_count=3), [])
+
+    def test_every_new_message_is_analyzed_exactly_once(self):
+        msgs = [message(i) for i in range(40)]
+        chunks = self.utils.chunk_messages(msgs, context_count=5, token_budget=self.line_tokens * 8)
+        self.assertGreater(len(chunks), 1)
+        owned = [mid for ids in self.own_ids(chunks) for mid in ids]
+        self.assertEqual(sorted(owned), sorted(m["id"] for m in msgs[5:]))
+        self.assertEqual(len(owned), len(set(owned)))
+        self.assertEqual(chunks[0][1], 5)
+        self.assertTrue(all(context == 0 for _, context, _ in chunks[1:]))
+
+    def test_reply_threads_stay_in_one_chunk(self):
+        # m1 的回覆分散在後面，預算只夠放幾則訊息，整串仍要在同一段
+        msgs = [message(i, reply_to=1 if i in (9, 17, 25) else None) for i in range(30)]
+        chunks = self.utils.chunk_messages(msgs, token_budget=self.line_tokens * 6)
+        thread_chunks = [k for k, ids in enumerate(self.own_ids(chunks)) if {"m1", "m9", "m17", "m25"} & set(ids)]
+        self.assertEqual(len(thread_chunks), 1)
+        self.assertTrue({"m1", "m9", "m17", "m25"} <= set(self.own_ids(chunks)[thread_chunks[0]]))
+
+    def test_thread_larger_than_the_budget_is_split(self):
+        msgs = [message(0)] + [message(i, reply_to=0) for i in range(1, 12)]
+        budget = self.line_tokens * 4
+        chunks = self.utils.chunk_messages(msgs, token_budget=budget)
+        self.assertGreater(len(chunks), 1)
+        # 依訊息順序切開，每段都不超過預算
+        self.assertEqual([mid for ids in self.own_ids(chunks) for mid in ids], [m["id"] for m in msgs])
+        for msgs_in_chunk, _, followup in chunks:
+            own = msgs_in_chunk[:len(msgs_in_chunk) - followup]
+            cost = sum(utils.estimate_tokens(self.utils._format_dialog_line(m)) + 1 for m in own)
+            self.assertLessEqual(cost, budget)
+
+    def test_chunks_carry_following_messages_as_follow_up(self):
+        msgs = [message(i) for i in range(12)]
+        with mock.patch.object(utils, "CHUNK_FOLLOWUP_MESSAGES", 2):
+            chunks = self.utils.chunk_messages(msgs, token_budget=self.line_tokens * 5)
+        first, _, followup = chunks[0]
+        self.assertEqual(followup, 2)
+        self.assertEqual([m["id"] for m in first[-2:]], ["m5", "m6"])
+        self.assertEqual(chunks[-1][2], 0)
+        prompt = self.utils.make_prompt_for_unanswered_questions(first, followup_count=followup)
+        self.assertLess(prompt.index("message 4"), prompt.index("[之後的對話"))
+        self.assertLess(prompt.index("[之後的對話"), prompt.index("message 5"))
+
+
+class MergeQuestionListsTests(SimpleTestCase):
+    def test_same_asker_same_text_in_a_later_chunk_is_dropped(self):
+        merged = UnansweredTopicTrackerUtils.merge_question_lists([
+            [question("Who owns the release?")],
+            [question("who owns  the release ?", timestamp="2026-03-10T10:00:00Z")],
+        ])
+        self.assertEqual(merged, [question("Who owns the release?")])
+
+    def test_different_questions_with_same_or_empty_timestamp_are_kept(self):
+        lists = [
+            [question("Q1", timestamp=""), question("Q2", timestamp="")],
+            [question("Q3", timestamp="t"), question("Q4", timestamp="t")],
+        ]
+        self.assertEqual(len(UnansweredTopicTrackerUtils.merge_question_lists(lists)), 4)
+
+    def test_same_text_from_another_asker_is_kept(self):
+        merged = UnansweredTopicTrackerUtils.merge_question_lists([[question("Q1", "A")], [question("Q1", "B")]])
+        self.assertEqual([q["asker"] for q in merged], ["A", "B"])
+
+    def test_single_chunk_result_is_returned_unchanged(self):
+        analyzer = UnansweredTopicTrackerUtils.__new__(UnansweredTopicTrackerUtils)
+        output = (
+            "---\n問題內容：Q1\n提問者：A\n時間：\n為何被視為未回應問題：x\n"
+            "---\n問題內容：Q1\n提問者：A\n時間：\n為何被視為未回應問題：y\n"
+        )
+        analyzer._generate = lambda prompt: output
+        result = analyzer.analyze_unanswered_questions([message(i) for i in range(3)])
+        self.assertEqual([q["reason"] for q in result], ["x", "y"])
@@ -1,9 +1,61 @@
 from typing import List, Dict, Any
-from bs4 import BeautifulSoup
-import json
+import hashlib
 from google import generativeai as genai
 import yaml
 import re
+from django.conf import settings
+from core.models import ChatMessage
+from core.rate_limit import TokenBucket
+from core.utils import threaded_map
+
+# 每個 chunk 的對話內容最多約幾個 token（不含固定的提示文字）；超過就切成多段分別分析
+CHUNK_TOKEN_BUDGET = getattr(settings, 'UTT_CHUNK_TOKEN_BUDGET', 8000)
+# 每段後面再附上幾則之後的訊息，讓段落結尾的問題也能看到有沒有人回應
+CHUNK_FOLLOWUP_MESSAGES = getattr(settings, 'UTT_CHUNK_FOLLOWUP_MESSAGES', 10)
+# 同一次分析最多同時送出幾個 Gemini 請求
+LLM_CONCURRENCY = getattr(settings, 'UTT_LLM_CONCURRENCY', 4)
+# 所有 worker 共用的 Gemini 請求 token bucket（每秒補充數 / burst）
+LLM_RATE_LIMIT = getattr(settings, 'UTT_LLM_RATE_LIMIT', {"rate": 1, "capacity": 4})
+# Gemini 回覆 quota / rate limit 錯誤後，所有 worker 暫停送出請求的秒數
+LLM_QUOTA_BACKOFF = getattr(settings, 'UTT_LLM_QUOTA_BACKOFF', 30)
+
+# 中日韓文字大約一字一個 token，其他文字大約四個字元一個 token
+_CJK_RE = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of text, good enough for budgeting without calling count_tokens."""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _group_reply_threads(msgs: List[Dict]) -> List[List[int]]:
+    """
+    Group message indices into reply threads: a message and every message replying to it
+    (directly or through other replies) end up in the same group.
+    Groups are returned in order of their first message, indices in each group ascending.
+    """
+    index = {msg.get('id'): i for i, msg in enumerate(msgs) if msg.get('id')}
+    root = list(range(len(msgs)))
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    for i, msg in enumerate(msgs):
+        reply_to_list = msg.get('reply_to_id') or []
+        for ref in reply_to_list if isinstance(reply_to_list, list) else []:
+            j = index.get(ref.get('msg_id'))
+            if j is not None:
+                a, b = find(i), find(j)
+                root[max(a, b)] = min(a, b)
+
+    threads = {}
+    for i in range(len(msgs)):
+        threads.setdefault(find(i), []).append(i)
+    return list(threads.values())
 
 class UnansweredTopicTrackerUtils:
     def __init__(self, config_path="/app/oauth_settings.yml"):
@@ -12,6 +64,9 @@ class UnansweredTopicTrackerUtils:
         self.GEMINI_API_KEY = config['GEMINI_API_KEY']
         genai.configure(api_key=self.GEMINI_API_KEY)
         self.model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+        # 同一把 API key 的所有 worker 共用一個 bucket（key 本身不寫進 Redis）
+        key_digest = hashlib.sha256(self.GEMINI_API_KEY.encode()).hexdigest()[:16]
+        self.rate_limiter = TokenBucket("gemini", key_digest, namespace="llm", **LLM_RATE_LIMIT)
 
     def parse_unanswered_questions(self, llm_output: str):
         if llm_output.strip().lower() == 'none':
@@ -42,58 +97,88 @@ class UnansweredTopicTrackerUtils:
 
 
 
-    def parse_graph_chat_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        parsed = []
-        for msg in messages:
-            msg_id = msg.get('id', '')
-            if msg.get('from') is None:
-                continue
-            sender = msg.get('from', {}).get('user', {}).get('displayName', 'Unknown')
-            html_content = msg.get('body', {}).get('content', '')
-            timestamp = msg.get('createdDateTime', '')
-            reply_to_id = []
-            attachments = msg.get('attachments', [])
-            for attachment in attachments:
-                if attachment.get("contentType") == "messageReference":
-                    try:
-                        referenced_msg = json.loads(attachment.get("content", "{}"))
-                        if reply_to_id is not None:
-                            reply_to_id.append({
-                                "msg_id": referenced_msg.get("messageId"),
-                                "sender": referenced_msg.get("messageSender").get('user').get('displayName'),
-                                "msg_preview": referenced_msg.get("messagePreview")
-                            })
-                    except Exception as e:
-                        print(f"Error parsing messageReference: {e}")
-            soup = BeautifulSoup(html_content, 'html.parser')
-            clean_text = soup.get_text(separator='\n').strip()
-            parsed.append({
-                "id": msg_id,
-                "sender": sender,
-                "text": clean_text,
-                "timestamp": timestamp,
-                "reply_to_id": None if len(reply_to_id) == 0 else reply_to_id
-            })
-        return parsed
+    @staticmethod
+    def _to_processed_message(msg: ChatMessage) -> Dict[str, Any]:
+        reply_to_id = None
+        if msg.reference_id:
+            reply_to_id = [{
+                "msg_id": msg.reference_id,
+                "sender": msg.reference_sender_name,
+                "msg_preview": msg.reference_preview or "",
+            }]
+        return {
+            "id": msg.message_id,
+            "sender": msg.sender_name or 'Unknown',
+            "text": msg.text,
+            "timestamp": msg.created.isoformat(),
+            "reply_to_id": reply_to_id
+        }
+
+    def load_chat_window(self, chat_id, since=None, context=0, limit=None):
+        """
+        Read only the part of a chat that still needs analysis: the oldest `limit` messages created
+        after `since`, preceded by up to `context` earlier messages, so replies in the new part can
+        be judged against the questions they answer. A longer backlog drains over later runs.
+        :return: (processed messages, number of leading context messages, created time of the last
+                  message returned, i.e. the next `since`, or None)
+        """
+        new_qs = ChatMessage.objects.filter(chat_id=chat_id)
+        if since is not None:
+            new_qs = new_qs.filter(created__gt=since)
+        new_qs = new_qs.order_by('created', 'pk')
+        new_msgs = list(new_qs[:limit] if limit else new_qs)
+        if not new_msgs:
+            return [], 0, None
+        if limit and len(new_msgs) == limit:
+            # 游標是時間，同一時間的訊息要一起讀完，否則下次從 created__gt 開始會漏掉
+            last = new_msgs[-1]
+            new_msgs += list(new_qs.filter(created=last.created, pk__gt=last.pk))
+        context_msgs = []
+        if context:
+            context_msgs = list(
+                ChatMessage.objects.filter(chat_id=chat_id, created__lt=new_msgs[0].created)
+                .order_by('-created')[:context]
+            )[::-1]
+        processed = [self._to_processed_message(msg) for msg in context_msgs + new_msgs]
+        return processed, len(context_msgs), new_msgs[-1].created
+
+    @staticmethod
+    def _format_dialog_line(msg: Dict) -> str:
+        time = msg.get('timestamp', '未知時間')
+        sender = msg.get('sender', '未知發話者')
+        text = msg.get('text', '').replace('\n', ' ')
+        reply_to_list = msg.get('reply_to_id', [])
+        if isinstance(reply_to_list, list) and len(reply_to_list) > 0:
+            reply_info = reply_to_list[0]
+            reply_sender = reply_info.get("sender", "未知對象")
+            msg_preview = reply_info.get("msg_preview", "").strip().replace('\n', ' ')
+            reply_tag = f"(回覆: {reply_sender}「{msg_preview}」)"
+        else:
+            reply_tag = ""
+        return f"{time} - {sender} {reply_tag}: {text}"
 
-    def make_prompt_for_unanswered_questions(self, processed_msgs: List[Dict], max_len=None):
+    def make_prompt_for_unanswered_questions(self, processed_msgs: List[Dict], max_len=None, context_count=0,
+                                             followup_count=0):
+        """
+        :param max_len: keep at most the latest max_len messages
+        :param context_count: the first context_count messages were analyzed in an earlier run and are
+                              only there so replies can be judged; their questions are not reported again
+        :param followup_count: the last followup_count messages belong to a later chunk and are only
+                               there so replies to this chunk's questions can be seen
+        """
         sorted_msgs = sorted(processed_msgs, key=lambda x: x.get('timestamp', ''))
+        if max_len and len(sorted_msgs) > max_len:
+            context_count = max(0, context_count - (len(sorted_msgs) - max_len))
+            sorted_msgs = sorted_msgs[-max_len:]
         dialog_lines = []
         for count, msg in enumerate(sorted_msgs):
-            if max_len and count >= max_len:
-                break
-            time = msg.get('timestamp', '未知時間')
-            sender = msg.get('sender', '未知發話者')
-            text = msg.get('text', '').replace('\n', ' ')
-            reply_to_list = msg.get('reply_to_id', [])
-            if isinstance(reply_to_list, list) and len(reply_to_list) > 0:
-                reply_info = reply_to_list[0]
-                reply_sender = reply_info.get("sender", "未知對象")
-                msg_preview = reply_info.get("msg_preview", "").strip().replace('\n', ' ')
-                reply_tag = f"(回覆: {reply_sender}「{msg_preview}」)"
-            else:
-                reply_tag = ""
-            dialog_lines.append(f"{time} - {sender} {reply_tag}: {text}")
+            if context_count and count == 0:
+                dialog_lines.append("[先前已分析過的對話，僅供判斷是否有回應，不要列出其中的問題]")
+            if context_count and count == context_count:
+                dialog_lines.append("[新的對話]")
+            if followup_count and count == len(sorted_msgs) - followup_count:
+                dialog_lines.append("[之後的對話，僅供判斷上面的問題是否有回應，不要列出其中的問題]")
+            dialog_lines.append(self._format_dialog_line(msg))
         dialog_text = "\n".join(dialog_lines)
         prompt = (
             """
@@ -124,11 +209,54 @@ class UnansweredTopicTrackerUtils:
         prompt = prompt.replace('\n', ' ').replace('\xa0', ' ')
         return prompt
 
-    def analyze_unanswered_questions(self, raw_chat):
-        processed_msgs = self.parse_graph_chat_messages(raw_chat)
-        prompt = self.make_prompt_for_unanswered_questions(processed_msgs)
-        try:
-            first_response = self.model.generate_content(
+    def chunk_messages(self, processed_msgs: List[Dict], context_count=0, token_budget=None):
+        """
+        Split time-ordered messages into chunks whose dialog fits in token_budget, keeping reply
+        threads together. Whole threads are packed in order of their first message; only a thread
+        larger than the budget is cut, at message boundaries.
+        :param context_count: the first context_count messages are context from an earlier run
+        :return: list of (messages, context_count, followup_count) ready for make_prompt_for_unanswered_questions;
+                 chunks that contain only context messages are dropped
+        """
+        budget = token_budget or CHUNK_TOKEN_BUDGET
+        costs = [estimate_tokens(self._format_dialog_line(msg)) + 1 for msg in processed_msgs]
+        if sum(costs) <= budget:
+            return [(processed_msgs, context_count, 0)] if len(processed_msgs) > context_count else []
+
+        groups, current, current_cost = [], [], 0
+        for thread in _group_reply_threads(processed_msgs):
+            pieces, piece, piece_cost = [], [], 0
+            for i in thread:
+                if piece and piece_cost + costs[i] > budget:
+                    pieces.append((piece, piece_cost))
+                    piece, piece_cost = [], 0
+                piece.append(i)
+                piece_cost += costs[i]
+            pieces.append((piece, piece_cost))
+            for piece, piece_cost in pieces:
+                if current and current_cost + piece_cost > budget:
+                    groups.append(current)
+                    current, current_cost = [], 0
+                current += piece
+                current_cost += piece_cost
+        if current:
+            groups.append(current)
+
+        chunks = []
+        for group in groups:
+            group = sorted(group)
+            chunk_context = sum(1 for i in group if i < context_count)
+            if chunk_context == len(group):
+                continue
+            members = set(group)
+            followups = [i for i in range(group[-1] + 1, len(processed_msgs)) if i not in members]
+            followups = followups[:CHUNK_FOLLOWUP_MESSAGES]
+            chunks.append(([processed_msgs[i] for i in group + followups], chunk_context, len(followups)))
+        return chunks
+
+    def _generate(self, prompt: str) -> str:
+        self.rate_limiter.acquire()
+        return self.model.generate_content(
             prompt,
             generation_config={
                 "temperature": 0,
@@ -137,12 +265,24 @@ class UnansweredTopicTrackerUtils:
                 "max_output_tokens": 1024,
                 "stop_sequences": []
             } # type: ignore
-            ).text
+        ).text
+
+    def _analyze_chunk(self, chunk, raise_errors=False):
+        msgs, context_count, followup_count = chunk
+        prompt = self.make_prompt_for_unanswered_questions(
+            msgs, context_count=context_count, followup_count=followup_count
+        )
+        try:
+            first_response = self._generate(prompt)
         except Exception as e:
             if "quota" in str(e).lower() or "limit" in str(e).lower():
                 print("API hit limit or quota exceeded.")
+                # 讓其他 chunk / worker 先暫停，不要繼續撞 quota
+                self.rate_limiter.block(LLM_QUOTA_BACKOFF)
             else:
                 print(f"Error during API call: {e}")
+            if raise_errors:
+                raise
             first_response = "None"
         print("🔍 初步回應：\n", first_response)
         # refine_prompt = f"""你剛才的回應是：
@@ -164,3 +304,46 @@ class UnansweredTopicTrackerUtils:
         # ).text
         # print("✨ 精煉後結果：\n", refined_response)
         return self.parse_unanswered_questions(first_response)
+
+    @staticmethod
+    def merge_question_lists(question_lists: List[List[Dict]]) -> List[Dict]:
+        """
+        Concatenate per-chunk results in chunk order, dropping a question only when the same asker
+        reported the same text (ignoring whitespace and case) in an earlier chunk.
+        Semantic duplicates are left to dedup_indices.
+        """
+        merged, seen = [], set()
+        for questions in question_lists:
+            keys = set()
+            for q in questions:
+                key = (q.get("asker", ""), re.sub(r'\s+', '', q.get("question", "")).lower())
+                if key in seen:
+                    continue
+                keys.add(key)
+                merged.append(q)
+            seen |= keys
+        return merged
+
+    def analyze_unanswered_questions(self, processed_msgs, max_len=None, context_count=0, raise_errors=False):
+        """
+        Long chats are split into token-budgeted chunks (see chunk_messages) that are analyzed
+        concurrently, at most LLM_CONCURRENCY at a time and paced by the shared Gemini rate limit,
+        then merged; a chat that fits in one chunk is a single request as before.
+        :param raise_errors: re-raise Gemini errors instead of treating them as "no unanswered
+                             questions", so callers that keep a cursor do not skip the window
+        """
+        sorted_msgs = sorted(processed_msgs, key=lambda x: x.get('timestamp', ''))
+        if max_len and len(sorted_msgs) > max_len:
+            context_count = max(0, context_count - (len(sorted_msgs) - max_len))
+            sorted_msgs = sorted_msgs[-max_len:]
+        chunks = self.chunk_messages(sorted_msgs, context_count)
+        if len(chunks) > 1:
+            print(f"✂️ 對話共 {len(sorted_msgs)} 則，分成 {len(chunks)} 段分析")
+        results = threaded_map(lambda chunk: self._analyze_chunk(chunk, raise_errors), chunks, LLM_CONCURRENCY)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            # 只有 raise_errors 時 _analyze_chunk 才會丟例外；任何一段失敗整個視窗都要重做
+            raise errors[0]
+        if len(results) == 1:
+            return results[0]
+        return self.merge_question_lists(results)
@@ -143,4 +143,51 @@ STATICFILES_DIRS = [
 ]
 
 CELERY_BROKER_URL = 'redis://redis:6379'  # 使用 Redis 作為 Celery 的 Broker
-CELERY_RESULT_BACKEND = 'redis://redis:6379'  # 使用 Redis 作為 Celery 的結果後端
\ No newline at end of file
+CELERY_RESULT_BACKEND = 'redis://redis:6379'  # 使用 Redis 作為 Celery 的結果後端
+
+# Microsoft Graph HTTP transport（每個 process 共用一個 keep-alive 連線池）
+GRAPH_HTTP_POOL_CONNECTIONS = 10  # 快取的 host 連線池數量
+GRAPH_HTTP_POOL_MAXSIZE = 20      # 每個 host 最多保留的連線數（threads 併發時使用）
+GRAPH_HTTP_TIMEOUT = 60           # 秒
+GRAPH_TOKEN_EXPIRY_SKEW = 300     # 秒，access token 在到期前多久就重新整理
+GRAPH_RESOLUTION_CACHE_TTL = 60 * 60 * 24  # 秒，SharePoint site/drive/list id 快取時間
+GRAPH_CHAT_INDEX_TTL = 60 * 60 * 24 * 7  # 秒，一對一聊天索引快取時間
+GRAPH_CHAT_INDEX_MISS_TTL = 60 * 10      # 秒，找不到一對一聊天的人多久後再重新查
+GRAPH_DIRECTORY_TTL = 60 * 60 * 24       # 秒，email -> 使用者資料快取時間
+GRAPH_DIRECTORY_NEGATIVE_TTL = 60 * 60   # 秒，查無此人的 email 快取時間
+GRAPH_MAX_RETRIES = 4        # 429 / 503 最多重試次數
+GRAPH_MAX_RETRY_AFTER = 120  # 秒，Retry-After 超過這個值就直接失敗，交給 celery 重排
+# 所有 worker 共用的 Redis token bucket（每秒補充數 / burst），未列出的使用 core/rate_limit.py 的預設值
+# GRAPH_RATE_LIMITS = {"tenant": {"rate": 30, "capacity": 60}, "chat_message_send": {"rate": 4, "capacity": 8}}
+
+# web 與 celery worker 共用的快取（SharePoint id 解析等）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    }
+}
+
+# SharePoint reminders
+# REMINDERS_WORKBOOK_CACHE_DIR = BASE_DIR / ".cache" / "workbooks"  # 解析後工作表的 pickle 快取，目錄權限會設成 0700
+# REMINDERS_RANGE_READ_MIN_BYTES = 5 * 1024 * 1024  # 超過此大小改用 workbook API 只讀需要的欄位
+# REMINDERS_RANGE_READ_CHUNK_ROWS = 5000            # range read 每次請求的列數
+# REMINDERS_XLSX_ENGINE = "auto"  # auto / calamine / openpyxl，auto 在有安裝 python-calamine 時使用它
+# REMINDERS_NOTIFY_DIGEST = False  # True：同一聊天室同一 owner 的通知合併成一則編號訊息，owner 需以「#編號 回覆」逐項回覆
+# REMINDERS_DIGEST_MAX_ITEMS = 20  # 一則合併訊息最多列出幾個通知
+# REMINDERS_SCAN_CONCURRENCY = 4         # scanAnyMatchMsg 同時掃描的聊天室數
+# REMINDERS_DAEMON_HOST_CONCURRENCY = 2  # daemon_task 同時掃描的 host 數
+
+# Unanswered topic tracker
+# UTT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'  # 問題去重用的句向量模型
+# UTT_EMBEDDING_THREADS = 1                  # 每個 worker process 的 torch CPU thread 數（None 則由 torch 自行決定）
+# UTT_EMBEDDING_WARMUP = False               # True：worker process 啟動時預先載入模型（只建議用在專跑 UTT 任務的 worker）
+# UTT_DEDUP_THRESHOLD = 0.9        # cosine similarity 超過此值視為重複問題
+# UTT_DEDUP_ANN_MIN_SIZE = 50000   # 問題數超過此值且有 faiss 時改用近似最近鄰
+# UTT_ANALYSIS_MAX_NEW_MESSAGES = 300  # 每次分析最多幾則新訊息（由舊到新，其餘留到下次）
+# UTT_ANALYSIS_CONTEXT_MESSAGES = 30   # 往前帶幾則已分析過的訊息當上下文
+# UTT_CHUNK_TOKEN_BUDGET = 8000       # 每段對話最多約幾個 token，超過就切段平行分析
+# UTT_CHUNK_FOLLOWUP_MESSAGES = 10    # 每段後面附上幾則之後的訊息，判斷段落結尾的問題是否有回應
+# UTT_LLM_CONCURRENCY = 4             # 同一次分析最多同時送出幾個 Gemini 請求
+# UTT_LLM_RATE_LIMIT = {"rate": 1, "capacity": 4}  # 所有 worker 共用的 Gemini 請求 token bucket
+# UTT_LLM_QUOTA_BACKOFF = 30          # 秒，Gemini 回覆 quota 錯誤後暫停送出請求的時間
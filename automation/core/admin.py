@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import UserToken
+from .models import UserToken, DirectoryEntry
 # Register your models here.
 admin.site.register(UserToken)
+admin.site.register(DirectoryEntry)
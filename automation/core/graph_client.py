@@ -1,6 +1,16 @@
 import requests
 import base64
 import json
+import os
+import random
+import threading
+import time
+from functools import cached_property
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import timedelta
 from django.utils.dateparse import parse_datetime
 from io import BytesIO
 import pandas as pd
@@ -8,10 +18,59 @@ from typing import TYPE_CHECKING, List, Dict, Any
 if TYPE_CHECKING:
     from meetings.models import AutoScheduleMeeting
 GRAPH_URL = 'https://graph.microsoft.com/v1.0'
-from core.models import UserToken
-from urllib.parse import quote
+from core.models import UserToken, DirectoryEntry
+from core.rate_limit import buckets_for, retry_after_seconds
+from urllib.parse import quote, urlparse
 from datetime import timezone as TZ
 
+# 提前多久視為過期，避免 token 在請求途中失效
+TOKEN_EXPIRY_SKEW = timedelta(seconds=getattr(settings, 'GRAPH_TOKEN_EXPIRY_SKEW', 300))
+# SharePoint site / drive / list id 幾乎不會變，web 與 celery worker 共用快取
+RESOLUTION_CACHE_TTL = getattr(settings, 'GRAPH_RESOLUTION_CACHE_TTL', 60 * 60 * 24)
+# 一對一聊天 userId -> chatId 索引（chat id 不會變，只需補上新出現的人）
+CHAT_INDEX_TTL = getattr(settings, 'GRAPH_CHAT_INDEX_TTL', 60 * 60 * 24 * 7)
+CHAT_INDEX_MISS_TTL = getattr(settings, 'GRAPH_CHAT_INDEX_MISS_TTL', 60 * 10)
+# email -> 使用者資料 的目錄快取，查無此人的結果也會快取（較短時間）
+DIRECTORY_TTL = timedelta(seconds=getattr(settings, 'GRAPH_DIRECTORY_TTL', 60 * 60 * 24))
+DIRECTORY_NEGATIVE_TTL = timedelta(seconds=getattr(settings, 'GRAPH_DIRECTORY_NEGATIVE_TTL', 60 * 60))
+DIRECTORY_SELECT = 'id,displayName,mail'
+# Graph $batch 一次最多 20 個 sub-request
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_RETRIES = getattr(settings, 'GRAPH_BATCH_MAX_RETRIES', 3)
+BATCH_RETRY_STATUS = (429, 503, 504)
+# 被 Graph 限流時的重試：429 代表請求被拒絕、沒有執行，任何 method 都可以重送；
+# 503 可能已經執行一部分，只重送 idempotent 的呼叫
+THROTTLE_STATUS = (429, 503)
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+MAX_RETRIES = getattr(settings, 'GRAPH_MAX_RETRIES', 4)
+MAX_BACKOFF = getattr(settings, 'GRAPH_MAX_BACKOFF', 60)          # 秒，沒有 Retry-After 時的退避上限
+MAX_RETRY_AFTER = getattr(settings, 'GRAPH_MAX_RETRY_AFTER', 120)  # 秒，Retry-After 超過這個值就不在 request 內等待
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Return the pooled keep-alive session shared by every GraphClient in this process.
+    The session is rebuilt after a fork so Celery prefork workers never share sockets.
+    """
+    global _http_session, _http_session_pid
+    pid = os.getpid()
+    if _http_session is None or _http_session_pid != pid:
+        with _http_session_lock:
+            if _http_session is None or _http_session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=getattr(settings, 'GRAPH_HTTP_POOL_CONNECTIONS', 10),
+                    pool_maxsize=getattr(settings, 'GRAPH_HTTP_POOL_MAXSIZE', 20),
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _http_session = session
+                _http_session_pid = pid
+    return _http_session
+
 class GraphClient:
     def __init__(self, user_id):
         """
@@ -19,42 +78,108 @@ class GraphClient:
         """
         self.base_url = GRAPH_URL
         self.user_id = user_id
-        self.me = self.get_user_info()
+        self.session = get_http_session()
+        self.timeout = getattr(settings, 'GRAPH_HTTP_TIMEOUT', 60)
+        self._access_token = None
+        self._token_expires_at = None
+        self._resolved_keys = set()
         self.domain = "unizyx.sharepoint.com"
 
-    def _send_request(self, endpoint, method='GET', params=None, data=None, json=None):
+    @cached_property
+    def me(self):
+        """
+        Profile of the signed-in user, fetched on first access only.
+        """
+        return self.get_user_info()
+
+    def _get_access_token(self):
+        """
+        Return the bearer token kept in memory for this client.
+        The DB is only read again once the token is within TOKEN_EXPIRY_SKEW of expiring.
+        """
+        if self._access_token is None or timezone.now() >= self._token_expires_at - TOKEN_EXPIRY_SKEW:
+            token = UserToken.get_valid_token(self.user_id, skew=TOKEN_EXPIRY_SKEW)
+            self._access_token = token.access_token
+            self._token_expires_at = token.expires_at
+        return self._access_token
+
+    def _invalidate_access_token(self):
+        self._access_token = None
+        self._token_expires_at = None
+
+    def _resolve_cached(self, key, resolver):
+        """
+        Return a SharePoint id from the shared resolution cache, calling resolver() on a miss.
+        :param key: tuple such as ("site", domain, site_name)
+        """
+        cache_key = "graph:resolve:" + ":".join(key)
+        value = cache.get(cache_key)
+        if value is None:
+            value = resolver()
+            cache.set(cache_key, value, RESOLUTION_CACHE_TTL)
+        self._resolved_keys.add(cache_key)
+        return value
+
+    def _invalidate_resolved_ids(self):
+        cache.delete_many(list(self._resolved_keys))
+        self._resolved_keys.clear()
+
+    def _send_request(self, endpoint, method='GET', params=None, data=None, json=None, headers=None, tokens=1):
         """
         A generic method to send requests to Microsoft Graph API.
+        :param headers: extra request headers, e.g. {'workbook-session-id': ...}
+        :param tokens: rate limit tokens the call costs, e.g. the number of sub-requests of a $batch POST
         """
-        try:
-            user = UserToken.objects.filter(user_id=self.user_id).first()
-        except Exception as e:
-            print(e)
-            user = None
-        if not user:
-            raise ValueError(f"UserToken not found for user_id: {self.user_id}")
-        
+        extra_headers = headers or {}
         if endpoint.startswith('http'):
             url = endpoint
         else:
             url = f'{self.base_url.rstrip("/")}/{endpoint.lstrip("/")}'
-            
-        headers = {
-            'Authorization': f'Bearer {user.get_token()}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=headers,
-            params=params,
-            json=json,
-            data=data
-        )
+
+        buckets = buckets_for(self.domain, method, urlparse(url).path)
+        auth_retried = False
+        attempt = 0
+        while True:
+            for bucket in buckets:
+                # 超過 capacity 永遠拿不到，最多等到 bucket 全滿
+                bucket.acquire(min(tokens, bucket.capacity))
+            request_headers = {
+                'Authorization': f'Bearer {self._get_access_token()}',
+                'Content-Type': 'application/json',
+                **extra_headers,
+            }
+            response = self.session.request(
+                method=method,
+                url=url,
+                headers=request_headers,
+                params=params,
+                json=json,
+                data=data,
+                timeout=self.timeout
+            )
+            if response.status_code == 401 and not auth_retried:
+                # token 可能在別的 worker 被撤銷或更新，重新讀取後再試一次
+                auth_retried = True
+                self._invalidate_access_token()
+                continue
+            wait = self._throttle_wait(method, response, attempt)
+            if wait is None:
+                break
+            # 最明確的那個 bucket 暫停發放 token，其他 worker 也會一起等
+            buckets[-1].block(wait)
+            print(f"⏳ Graph throttled ({response.status_code}) {method} {urlparse(url).path}, retrying in {wait:.1f}s")
+            time.sleep(wait)
+            attempt += 1
+        # 快取的 site / drive / list id 可能已失效（被刪除或改名），清掉讓下次重新查詢
+        if response.status_code == 404 and '/sites/' in url and self._resolved_keys:
+            self._invalidate_resolved_ids()
         # 檢查響應狀態碼
-        if response.status_code not in (200, 201):
+        if response.status_code not in (200, 201, 204):
             print(f"⚠️ HTTP Error {response.status_code}: {response.text}")
             response.raise_for_status()
+        # 204 No Content（例如 closeSession）本來就沒有內容
+        if response.status_code == 204:
+            return response
 
         # 檢查是否為空響應
         if not response.text.strip():
@@ -68,6 +193,23 @@ class GraphClient:
         #     print(f"⚠️ Failed to decode JSON: {response.text}")
         #     raise
 
+    def _throttle_wait(self, method, response, attempt):
+        """
+        Seconds to wait before retrying a throttled response, or None when it should not be retried.
+        Retry-After is honored when present, otherwise exponential backoff with jitter is used.
+        """
+        status = response.status_code
+        if status not in THROTTLE_STATUS or attempt >= MAX_RETRIES:
+            return None
+        if status != 429 and method.upper() not in IDEMPOTENT_METHODS:
+            return None
+        retry_after = retry_after_seconds(response)
+        if retry_after is None:
+            return min(MAX_BACKOFF, 2 ** (attempt + 1)) * random.uniform(0.5, 1)
+        if retry_after > MAX_RETRY_AFTER:
+            return None
+        return retry_after + random.uniform(0, 1)
+
     def get_user_info(self):
         """
         Fetch user information and avatar from Microsoft Graph API.
@@ -80,76 +222,196 @@ class GraphClient:
             }
         )
         user_info = user_info.json()
-        user = UserToken.objects.filter(user_id=self.user_id).first()
-        if not user:
-            raise ValueError(f"UserToken not found for user_id: {self.user_id}")
         graph_endpoint = f'{self.base_url}/me/photo/$value'
         headers = {
-            'Authorization': f'Bearer {user.get_token()}'
+            'Authorization': f'Bearer {self._get_access_token()}'
         }
 
-        response = requests.get(graph_endpoint, headers=headers)
+        response = self.session.get(graph_endpoint, headers=headers, timeout=self.timeout)
         user_info['avatar'] = base64.b64encode(response.content).decode('utf-8')
 
         return user_info
 
     def get_user_info_by_email(self, email):
         """
-        Fetch user information by email.
+        Fetch user information by email, reading through the DirectoryEntry cache.
+        Raises ValueError when Graph does not know the email.
         """
-        endpoint = f'users/{email}'
-        user_info = self._send_request(
-            endpoint=endpoint,
-            # params={
-            #     '$select': 'displayName,mail,mailboxSettings,userPrincipalName,id'
-            # }
+        key = email.lower()
+        entry = DirectoryEntry.objects.filter(email=key).first()
+        if entry and entry.is_fresh(DIRECTORY_TTL, DIRECTORY_NEGATIVE_TTL):
+            if not entry.is_found():
+                raise ValueError(f"User not found: {email}")
+            return entry.as_user_info()
+
+        endpoint = f'users/{quote(email, safe="@")}'
+        try:
+            user_info = self._send_request(
+                endpoint=endpoint,
+                params={'$select': DIRECTORY_SELECT}
+            ).json()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                self._save_directory_entries({key: None})
+                raise ValueError(f"User not found: {email}")
+            raise
+        self._save_directory_entries({key: user_info})
+        return user_info
+
+    def _save_directory_entries(self, profiles):
+        """
+        Upsert DirectoryEntry rows.
+        :param profiles: dict of lowercase email -> Graph user dict, or None for unknown emails
+        """
+        now = timezone.now()
+        DirectoryEntry.objects.bulk_create(
+            [
+                DirectoryEntry(
+                    email=email,
+                    user_id=(info or {}).get('id'),
+                    display_name=(info or {}).get('displayName'),
+                    mail=(info or {}).get('mail'),
+                    fetched_at=now,
+                )
+                for email, info in profiles.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['email'],
+            update_fields=['user_id', 'display_name', 'mail', 'fetched_at'],
         )
-        return user_info.json()
 
-    def get_all_chats(self):
+    def batch(self, sub_requests):
+        """
+        Send sub-requests through the Graph JSON batching endpoint, 20 per POST.
+        Throttled items (429/503/504) are retried after their Retry-After with jitter.
+        :param sub_requests: list of dicts with 'url' and optional 'method', 'body', 'headers'
+        :return: list of dicts with 'status', 'headers' and 'body', in input order
+        """
+        results = [None] * len(sub_requests)
+        pending = list(range(len(sub_requests)))
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            retry, wait = [], 0
+            for start in range(0, len(pending), BATCH_MAX_REQUESTS):
+                payload = {"requests": []}
+                for idx in pending[start:start + BATCH_MAX_REQUESTS]:
+                    sub = sub_requests[idx]
+                    item = {
+                        "id": str(idx),
+                        "method": sub.get("method", "GET"),
+                        "url": "/" + sub["url"].lstrip("/"),
+                    }
+                    if sub.get("body") is not None:
+                        item["body"] = sub["body"]
+                        item["headers"] = {"Content-Type": "application/json", **sub.get("headers", {})}
+                    elif sub.get("headers"):
+                        item["headers"] = sub["headers"]
+                    payload["requests"].append(item)
+
+                # Graph 對 $batch 裡的每個 sub-request 分別計算限流，token 也要依數量扣
+                data = self._send_request(
+                    endpoint='$batch', method='POST', json=payload, tokens=len(payload["requests"])
+                ).json()
+                for item in data.get("responses", []):
+                    idx = int(item["id"])
+                    status = item.get("status")
+                    headers = item.get("headers", {})
+                    if status in BATCH_RETRY_STATUS and attempt < BATCH_MAX_RETRIES:
+                        retry.append(idx)
+                        wait = max(wait, float(headers.get("Retry-After", 2 ** attempt)))
+                        continue
+                    results[idx] = {"status": status, "headers": headers, "body": item.get("body")}
+            if not retry:
+                break
+            time.sleep(wait + random.uniform(0, 1))
+            pending = sorted(retry)
+        return results
+
+    def get_users_by_email(self, emails):
+        """
+        Resolve many emails at once: fresh DirectoryEntry rows are used as-is and the rest
+        are fetched with batched users/{email} calls and written back to the directory.
+        :return: dict of email -> {'id', 'displayName', 'mail'}, or None when the user does not exist.
+                 Emails whose lookup failed for another reason are left out so callers can retry them.
+        """
+        emails = list(dict.fromkeys(e for e in emails if e))
+        cached = {
+            entry.email: entry
+            for entry in DirectoryEntry.objects.filter(email__in=[e.lower() for e in emails])
+        }
+        users, to_fetch = {}, []
+        for email in emails:
+            entry = cached.get(email.lower())
+            if entry and entry.is_fresh(DIRECTORY_TTL, DIRECTORY_NEGATIVE_TTL):
+                users[email] = entry.as_user_info()
+            else:
+                to_fetch.append(email)
+        if not to_fetch:
+            return users
+
+        responses = self.batch([
+            {"url": f"users/{quote(email, safe='@')}?$select={DIRECTORY_SELECT}"}
+            for email in to_fetch
+        ])
+        fetched = {}
+        for email, res in zip(to_fetch, responses):
+            if res and res["status"] == 200:
+                users[email] = fetched[email.lower()] = res["body"]
+            elif res and res["status"] == 404:
+                users[email] = fetched[email.lower()] = None
+            else:
+                print(f"⚠️ Batched lookup failed for {email}: {res['status'] if res else 'no response'}")
+        if fetched:
+            self._save_directory_entries(fetched)
+        return users
+
+    def _walk_one_on_one_chats(self):
         """
-        Fetch all chats for the authenticated user.
+        Yield (chat_id, member user ids) for every one-on-one chat, members expanded inline.
         """
-        chats = []
         url = 'me/chats'
-        
+        params = {'$expand': 'members', '$top': 50}
         while url:
-            data = self._send_request(endpoint=url).json()
-            chats.extend(data.get('value', []))
+            data = self._send_request(endpoint=url, params=params).json()
+            for chat in data.get('value', []):
+                if chat.get("chatType") == "oneOnOne":
+                    yield chat.get("id"), [member.get("userId") for member in chat.get("members", [])]
             url = data.get('@odata.nextLink', None)
-
-        return chats
+            params = None  # nextLink 已包含查詢參數
 
     def get_chat_ids(self, user_ids):
         """
         Fetch chat IDs for one-on-one chats with the authenticated user.
+        Uses a cached userId -> chatId index per host; chats are only walked again
+        for users missing from the index, and the walk stops once they are all found.
         """
         if not user_ids:
             raise ValueError("User IDs list cannot be empty.")
 
         try:
-            chats = self.get_all_chats()
-            if not chats:
-                raise Exception("No chats found for the authenticated user.")
-
-            chat_ids = []
-            for user_id in user_ids:
-                matched_chat_id = next(
-                    (
-                        chat.get("id")
-                        for chat in chats
-                        if chat.get("chatType") == "oneOnOne" and any(
-                            member.get("userId") == user_id
-                            for member in self._send_request(
-                                endpoint=f'chats/{chat.get("id")}/members'
-                            ).json().get("value", [])
-                        )
-                    ),
-                    None
-                )
-                chat_ids.append(matched_chat_id)
-
-            return chat_ids
+            index_key = f"graph:chats:oneonone:{self.user_id}"
+            index = cache.get(index_key) or {}
+            missing = {
+                uid for uid in user_ids
+                if uid and uid not in index and not cache.get(f"{index_key}:miss:{uid}")
+            }
+            if missing:
+                walked = 0
+                for chat_id, member_ids in self._walk_one_on_one_chats():
+                    walked += 1
+                    for member_id in member_ids:
+                        if member_id and member_id != self.user_id:
+                            index[member_id] = chat_id
+                            missing.discard(member_id)
+                    if not missing:
+                        break
+                if walked == 0 and not index:
+                    raise Exception("No chats found for the authenticated user.")
+                cache.set(index_key, index, CHAT_INDEX_TTL)
+                # 沒有一對一聊天的人短暫記住，避免每次都重新掃過所有聊天
+                for uid in missing:
+                    cache.set(f"{index_key}:miss:{uid}", True, CHAT_INDEX_MISS_TTL)
+
+            return [index.get(user_id) for user_id in user_ids]
         except Exception as e:
             raise ValueError(f"Error fetching chat IDs: {str(e)}")
     
@@ -318,20 +580,25 @@ class GraphClient:
             url = data.get('@odata.nextLink', None)
         return contacts
     def list_drive(self,site_name="NebulaP8group"):
-        url = f"/sites/{self._get_site_id(site_name)}/drives"
-        dn_ls = [drive['name'] for drive in self._send_request(url).json()["value"]]
+        dn_ls = list(self._get_site_drives(site_name))
         return dn_ls
     def _get_site_id(self, site_name):
-        url = f"/sites/{self.domain}:/sites/{site_name}"
-        self.site_id = self._send_request(url).json().get("id")
-        return self.site_id
+        def resolve():
+            url = f"/sites/{self.domain}:/sites/{site_name}"
+            return self._send_request(url).json().get("id")
+        return self._resolve_cached(("site", self.domain, site_name), resolve)
+    def _get_site_drives(self, site_name):
+        """
+        Return {drive name: drive id} for every document library of the site.
+        """
+        def resolve():
+            url = f"/sites/{self._get_site_id(site_name)}/drives"
+            return {drive["name"]: drive["id"] for drive in self._send_request(url).json()["value"]}
+        return self._resolve_cached(("drives", self.domain, site_name), resolve)
     def _get_site_and_drive_id(self, site_name, drive_name):
-        site_id = self._get_site_id(site_name)
-        url = f"/sites/{site_id}/drives"
-        for drive in self._send_request(url).json()["value"]:
-            if drive["name"] == drive_name:
-                drive_id = drive["id"]
-                return site_id ,drive_id
+        drives = self._get_site_drives(site_name)
+        if drive_name in drives:
+            return self._get_site_id(site_name), drives[drive_name]
         raise Exception(f"Drive {drive_name} not found")
     def upload_excel_with_data(self, df, url):
         # 將 DataFrame 儲存成 Excel 檔（in memory）
@@ -0,0 +1,64 @@
+import json
+import time
+from unittest import mock
+
+import requests
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from urllib3.connection import HTTPConnection
+
+
+class _UnpooledSession:
+    """
+    Mimics the old transport: every call goes through a bare requests.request(),
+    so every call opens its own TCP+TLS connection.
+    """
+    def request(self, method, url, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return requests.get(url, **kwargs)
+
+
+class Command(BaseCommand):
+    help = "Run a Celery task eagerly and count the HTTP connections it opens, with and without the pooled Graph session."
+
+    def add_arguments(self, parser):
+        parser.add_argument("task", help="Registered task name, e.g. reminders.tasks.daemon_task")
+        parser.add_argument("--args", default="[]", help="JSON list of positional task arguments")
+        parser.add_argument("--mode", choices=["both", "pooled", "unpooled"], default="both")
+
+    def handle(self, *args, **options):
+        current_app.loader.import_default_modules()
+        task = current_app.tasks.get(options["task"])
+        if task is None:
+            raise CommandError(f"Task {options['task']} is not registered")
+        task_args = json.loads(options["args"])
+
+        modes = ["unpooled", "pooled"] if options["mode"] == "both" else [options["mode"]]
+        for mode in modes:
+            connections, elapsed = self._run(task, task_args, pooled=(mode == "pooled"))
+            self.stdout.write(f"{mode:>8}: {connections} connections opened, {elapsed:.2f}s")
+
+    def _run(self, task, task_args, pooled):
+        counter = {"count": 0}
+        original_new_conn = HTTPConnection._new_conn
+
+        def counting_new_conn(conn):
+            counter["count"] += 1
+            return original_new_conn(conn)
+
+        patches = [mock.patch.object(HTTPConnection, "_new_conn", counting_new_conn)]
+        if not pooled:
+            patches.append(mock.patch("core.graph_client.get_http_session", _UnpooledSession))
+
+        for p in patches:
+            p.start()
+        try:
+            start = time.perf_counter()
+            task.apply(args=task_args)
+            elapsed = time.perf_counter() - start
+        finally:
+            for p in reversed(patches):
+                p.stop()
+        return counter["count"], elapsed
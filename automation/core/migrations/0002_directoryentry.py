@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=255, unique=True)),
+                ('user_id', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('display_name', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('mail', models.EmailField(blank=True, default=None, max_length=254, null=True)),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
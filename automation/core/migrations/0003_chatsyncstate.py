@@ -0,0 +1,26 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_directoryentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=255)),
+                ('consumer', models.CharField(max_length=255)),
+                ('last_modified', models.DateTimeField(blank=True, default=None, null=True)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('chat_id', 'consumer'), name='unique_chat_sync_state')],
+            },
+        ),
+    ]
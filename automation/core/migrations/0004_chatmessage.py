@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_chatsyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=255)),
+                ('message_id', models.CharField(max_length=255)),
+                ('sender_id', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('sender_name', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('created', models.DateTimeField()),
+                ('last_modified', models.DateTimeField(blank=True, default=None, null=True)),
+                ('reference_id', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('reference_sender_name', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('reference_preview', models.TextField(blank=True, default=None, null=True)),
+                ('text', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat_id', 'created'], name='chatmessage_chat_created'), models.Index(fields=['chat_id', 'reference_id'], name='chatmessage_chat_reference')],
+                'constraints': [models.UniqueConstraint(fields=('chat_id', 'message_id'), name='unique_chat_message')],
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from datetime import timedelta
 from core.auth_helper import AuthHelper
@@ -13,17 +13,17 @@ class UserToken(models.Model):
     expires_at = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
-    def is_expired(self):
-        return timezone.now() >= self.expires_at
+    def is_expired(self, skew=timedelta(0)):
+        return timezone.now() >= self.expires_at - skew
 
-    def refresh_token_if_needed(self):
-        if self.is_expired():
+    def refresh_token_if_needed(self, skew=timedelta(0)):
+        if self.is_expired(skew):
             auth_app = auth_helper.get_msal_app()
             result = auth_app.acquire_token_by_refresh_token(
                 self.refresh_token,
                 scopes=auth_helper.settings['scopes'],
             )
-            if result:
+            if result and 'access_token' in result:
                 self.access_token = result['access_token']
                 self.refresh_token = result.get('refresh_token', self.refresh_token)
                 self.expires_at = timezone.now() + timedelta(seconds=result['expires_in'])
@@ -39,3 +39,96 @@ class UserToken(models.Model):
         if self.is_expired():
             self.refresh_token_if_needed()
         return self.access_token
+
+    @classmethod
+    def get_valid_token(cls, user_id, skew=timedelta(0)):
+        """
+        Returns the UserToken row for user_id with an access token valid for at least `skew`.
+        The refresh is single-flight: the row is locked with SELECT ... FOR UPDATE and
+        re-checked, so concurrent workers reuse the token the first one refreshed.
+        """
+        token = cls.objects.filter(user_id=user_id).first()
+        if not token:
+            raise ValueError(f"UserToken not found for user_id: {user_id}")
+        if not token.is_expired(skew):
+            return token
+        with transaction.atomic():
+            token = cls.objects.select_for_update().get(pk=token.pk)
+            token.refresh_token_if_needed(skew)
+        return token
+
+class DirectoryEntry(models.Model):
+    """
+    Cached Graph user profile keyed by lowercase email.
+    user_id is null when Graph does not know the email (negative cache).
+    """
+    email = models.CharField(max_length=255, unique=True)
+    user_id = models.CharField(max_length=255, null=True, blank=True, default=None)
+    display_name = models.CharField(max_length=255, null=True, blank=True, default=None)
+    mail = models.EmailField(null=True, blank=True, default=None)
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    def is_found(self):
+        return self.user_id is not None
+
+    def is_fresh(self, ttl, negative_ttl):
+        age = timezone.now() - self.fetched_at
+        return age < (ttl if self.is_found() else negative_ttl)
+
+    def as_user_info(self):
+        """
+        Returns the entry in the shape of a Graph user resource, or None for a negative entry.
+        """
+        if not self.is_found():
+            return None
+        return {"id": self.user_id, "displayName": self.display_name, "mail": self.mail}
+
+    def __str__(self):
+        return f"{self.email} -> {self.user_id or 'not found'}"
+
+class ChatSyncState(models.Model):
+    """
+    Watermark of how far a consumer has read a Teams chat.
+    Messages with lastModifiedDateTime after `last_modified` are new to that consumer.
+    """
+    chat_id = models.CharField(max_length=255)
+    consumer = models.CharField(max_length=255)
+    last_modified = models.DateTimeField(null=True, blank=True, default=None)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat_id', 'consumer'], name='unique_chat_sync_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.consumer} @ {self.chat_id}: {self.last_modified}"
+
+class ChatMessage(models.Model):
+    """
+    Teams chat message synced once from Graph and shared by the reminder reply scanner
+    and the unanswered-topic tracker. `text` is the HTML body already reduced to plain text.
+    """
+    chat_id = models.CharField(max_length=255)
+    message_id = models.CharField(max_length=255)
+    sender_id = models.CharField(max_length=255, null=True, blank=True, default=None)
+    sender_name = models.CharField(max_length=255, null=True, blank=True, default=None)
+    created = models.DateTimeField()
+    last_modified = models.DateTimeField(null=True, blank=True, default=None)
+    # 被回覆（messageReference）的訊息
+    reference_id = models.CharField(max_length=255, null=True, blank=True, default=None)
+    reference_sender_name = models.CharField(max_length=255, null=True, blank=True, default=None)
+    reference_preview = models.TextField(null=True, blank=True, default=None)
+    text = models.TextField(blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat_id', 'message_id'], name='unique_chat_message'),
+        ]
+        indexes = [
+            models.Index(fields=['chat_id', 'created'], name='chatmessage_chat_created'),
+            models.Index(fields=['chat_id', 'reference_id'], name='chatmessage_chat_reference'),
+        ]
+
+    def __str__(self):
+        return f"{self.chat_id}/{self.message_id} by {self.sender_name}"
@@ -0,0 +1,150 @@
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import redis
+from django.conf import settings
+
+# 每個 bucket：每秒補充的 token 數、最多可累積的 token 數（burst）
+# 預設值刻意低於 Graph / Teams 公告的上限，讓所有 worker 加總後仍在安全範圍內
+DEFAULT_RATE_LIMITS = {
+    "tenant": {"rate": 30, "capacity": 60},            # 整個 tenant 所有 Graph 呼叫
+    "chat_message_send": {"rate": 4, "capacity": 8},   # POST /chats/{id}/messages
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'GRAPH_RATE_LIMITS', {})}
+
+# (bucket 名稱, HTTP method, URL path 的 pattern)；符合的呼叫除了 tenant bucket 之外還要拿這個 bucket 的 token
+RESOURCE_PATTERNS = [
+    ("chat_message_send", "POST", re.compile(r"/chats/[^/]+/messages/?$")),
+]
+
+# 原子地補充並取出 token；回傳需要再等幾秒（0 代表已取得）
+# blocked_until 由 Retry-After 設定，期間內所有 worker 都先等待
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+local blocked_until = tonumber(state[3]) or 0
+if blocked_until > now then
+    return tostring(blocked_until - now)
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+_BLOCK_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local until_ts = now + tonumber(ARGV[1])
+local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+if until_ts > current then
+    redis.call('HSET', KEYS[1], 'blocked_until', until_ts)
+    redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', until_ts)
+end
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[1])) + 60)
+return 1
+"""
+
+_redis_client = None
+_redis_client_pid = None
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Redis client shared by every bucket in this process (rebuilt after fork, like the HTTP session).
+    """
+    global _redis_client, _redis_client_pid
+    pid = os.getpid()
+    if _redis_client is None or _redis_client_pid != pid:
+        with _redis_lock:
+            if _redis_client is None or _redis_client_pid != pid:
+                url = getattr(settings, 'GRAPH_RATE_LIMIT_REDIS_URL', None) or settings.CACHES['default']['LOCATION']
+                _redis_client = redis.Redis.from_url(url, socket_timeout=5)
+                _redis_client_pid = pid
+    return _redis_client
+
+
+class TokenBucket:
+    """
+    Token bucket stored in Redis so every web / celery process shares the same budget.
+    If Redis is unreachable the bucket lets calls through; Graph still protects itself with 429s.
+    """
+    def __init__(self, name, key, rate, capacity, namespace="graph"):
+        self.redis_key = f"{namespace}:ratelimit:{name}:{key}"
+        self.rate = rate
+        self.capacity = capacity
+
+    def acquire(self, tokens=1, max_wait=300):
+        """
+        Block until `tokens` are available.
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            try:
+                wait = float(get_redis().eval(_ACQUIRE_SCRIPT, 1, self.redis_key, self.rate, self.capacity, tokens))
+            except redis.RedisError as e:
+                print(f"⚠️ Rate limiter unavailable ({e}), continuing without it")
+                return waited
+            if wait <= 0:
+                return waited
+            if waited >= max_wait:
+                print(f"⚠️ Waited {waited:.1f}s for {self.redis_key}, continuing anyway")
+                return waited
+            # 加一點抖動，避免一群 worker 同時醒來搶同一批 token
+            sleep_for = min(wait, max_wait - waited) + random.uniform(0, 0.1)
+            time.sleep(sleep_for)
+            waited += sleep_for
+
+    def block(self, seconds):
+        """Stop handing out tokens for `seconds` (e.g. Graph answered 429 with Retry-After)."""
+        try:
+            get_redis().eval(_BLOCK_SCRIPT, 1, self.redis_key, seconds)
+        except redis.RedisError as e:
+            print(f"⚠️ Rate limiter unavailable ({e}), cannot apply Retry-After")
+
+
+def buckets_for(tenant, method, path):
+    """
+    Buckets a Graph call must take a token from: the tenant bucket plus any matching resource bucket.
+    """
+    buckets = [TokenBucket("tenant", tenant, **RATE_LIMITS["tenant"])]
+    for name, resource_method, pattern in RESOURCE_PATTERNS:
+        if method.upper() == resource_method and pattern.search(path):
+            buckets.append(TokenBucket(name, tenant, **RATE_LIMITS[name]))
+    return buckets
+
+
+def retry_after_seconds(response, default=None):
+    """
+    Parse the Retry-After header of a response (delta-seconds or HTTP date).
+    :return: seconds to wait, or `default` when the header is missing or invalid
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
@@ -1,5 +1,36 @@
 from core.graph_client import GraphClient
+from core.models import ChatSyncState, ChatMessage
 from bs4 import BeautifulSoup
+from datetime import timezone as TZ
+from django.utils.dateparse import parse_datetime
+import json
+
+# chat messages 一頁最多 50 筆
+MESSAGES_PAGE_SIZE = 50
+# 訊息庫的同步進度（所有 host 共用）
+MESSAGE_STORE_CONSUMER = "store"
+
+def html_to_text(html):
+    """
+    Reduce a Teams message body to plain text, one line per text node; emojis become their alt text.
+    """
+    soup = BeautifulSoup(html or "", "html.parser")
+    for emoji_tag in soup.find_all("emoji"):
+        if emoji_tag.has_attr("alt"):
+            emoji_tag.replace_with(emoji_tag["alt"])
+    return soup.get_text(separator='\n', strip=True)
+
+def index_replies(replies):
+    """
+    Index replies by (referenced message id, sender id) so each lookup is O(1).
+    The key (referenced message id, "") matches a reply from any sender.
+    :param replies: iterable of (reference_id, sender_id, value), newest first; the newest reply wins
+    """
+    index = {}
+    for reference_id, sender_id, value in replies:
+        index.setdefault((reference_id, sender_id), value)
+        index.setdefault((reference_id, ""), value)
+    return index
 
 class TeamsClient(GraphClient):
     """
@@ -42,33 +73,78 @@ class TeamsClient(GraphClient):
             raise Exception(f"Failed to send message: {response.status_code} {response.text}")
         return response.json()['id']
     # polling 用
-    def list_msg_in_chats(self, chat_id):
+    def list_msg_in_chats(self, chat_id, since=None, stop_at_watermark=True):
         """
-        List all messages in a chat.
+        List messages in a chat.
+        :param since: only return messages created or edited after this datetime (watermark).
+                      Pages are requested newest-first by lastModifiedDateTime.
+        :param stop_at_watermark: stop paging as soon as a page reaches messages at or before `since`.
         """
         endpoint = f"me/chats/{chat_id}/messages"
+        params = {"$top": MESSAGES_PAGE_SIZE}
+        if since:
+            since_str = since.astimezone(TZ.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            params["$orderby"] = "lastModifiedDateTime desc"
+            params["$filter"] = f"lastModifiedDateTime gt {since_str}"
         messages = []
         next_link = endpoint
 
         while next_link:
-            response = self._send_request(endpoint=next_link, method="GET")
+            response = self._send_request(endpoint=next_link, method="GET", params=params)
             if response.status_code != 200:
                 raise Exception(f"Failed to fetch messages: {response.status_code} {response.text}")
 
             data = response.json()
-            messages.extend(data.get("value", []))
+            page = data.get("value", [])
+            if since:
+                new_msgs = [m for m in page if self._last_modified(m) and self._last_modified(m) > since]
+                messages.extend(new_msgs)
+                if stop_at_watermark and len(new_msgs) < len(page):
+                    break
+            else:
+                messages.extend(page)
             # For pagination, Microsoft Graph returns @odata.nextLink as a full URL.
             next_link = data.get("@odata.nextLink")
+            params = None  # nextLink 已包含查詢參數
             if next_link:
                 # Remove the base URL if present, since _send_request expects endpoint only
                 next_link = next_link.replace(self.base_url, "").lstrip("/")
 
         return messages
+
+    @staticmethod
+    def _last_modified(message):
+        value = message.get("lastModifiedDateTime") or message.get("createdDateTime")
+        return parse_datetime(value) if value else None
+
+    def fetch_new_messages(self, chat_id, consumer):
+        """
+        Return the messages created or edited since `consumer` last synced this chat.
+        The watermark is not moved here; call mark_chat_synced once the messages are processed.
+        """
+        state = ChatSyncState.objects.filter(chat_id=chat_id, consumer=consumer).first()
+        return self.list_msg_in_chats(chat_id, since=state.last_modified if state else None)
+
+    def mark_chat_synced(self, chat_id, consumer, messages):
+        """
+        Advance the consumer's watermark to the newest lastModifiedDateTime in `messages`.
+        """
+        timestamps = [ts for ts in map(self._last_modified, messages) if ts]
+        if not timestamps:
+            return
+        state, _ = ChatSyncState.objects.get_or_create(chat_id=chat_id, consumer=consumer)
+        latest = max(timestamps)
+        if state.last_modified is None or latest > state.last_modified:
+            state.last_modified = latest
+            state.save()
+
     # 讀excel上的group name 用來找到特定的 chat ID
     def get_chat_id_by_name(self, chat_name):
         """
         Given a chat name, return the chat ID. Uses caching to avoid redundant API calls.
         """
+        if chat_name in self._chat_id_cache:
+            return self._chat_id_cache[chat_name]
         endpoint = "me/chats"
         next_link = endpoint
 
@@ -96,25 +172,62 @@ class TeamsClient(GraphClient):
                 next_link = next_link.replace(self.base_url, "").lstrip("/")
 
         raise Exception(f"Chat with name '{chat_name}' not found")
-    def _search_message_reference(self, messages, user_id, msg_id):
-        for message in messages:
-            attachments = message.get("attachments", [])
-            if not attachments:
+    def _to_chat_message(self, chat_id, message):
+        """
+        Convert a Graph chatMessage into an (unsaved) ChatMessage row.
+        """
+        sender = message.get("from") or {}
+        user = sender.get("user") or {}
+        application = sender.get("application") or {}
+        row = ChatMessage(
+            chat_id=chat_id,
+            message_id=message.get("id"),
+            sender_id=user.get("id"),
+            sender_name=user.get("displayName") or application.get("displayName"),
+            created=parse_datetime(message.get("createdDateTime")),
+            last_modified=self._last_modified(message),
+            text=html_to_text((message.get("body") or {}).get("content")),
+        )
+        for attachment in message.get("attachments") or []:
+            if attachment.get("contentType") != "messageReference":
                 continue
+            row.reference_id = attachment.get("id")
+            try:
+                referenced = json.loads(attachment.get("content") or "{}")
+                row.reference_sender_name = ((referenced.get("messageSender") or {}).get("user") or {}).get("displayName")
+                row.reference_preview = referenced.get("messagePreview")
+                row.reference_id = row.reference_id or referenced.get("messageId")
+            except ValueError as e:
+                print(f"Error parsing messageReference: {e}")
+            break
+        return row
+
+    def sync_chat_messages(self, chat_id):
+        """
+        Pull messages created or edited since the last sync into the ChatMessage store.
+        System events (no sender) are skipped. Returns the number of rows written.
+        """
+        messages = self.fetch_new_messages(chat_id, MESSAGE_STORE_CONSUMER)
+        rows = [self._to_chat_message(chat_id, m) for m in messages if m.get("from") is not None]
+        if rows:
+            ChatMessage.objects.bulk_create(
+                rows,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=["chat_id", "message_id"],
+                update_fields=[
+                    "sender_id", "sender_name", "last_modified", "reference_id",
+                    "reference_sender_name", "reference_preview", "text",
+                ],
+            )
+        self.mark_chat_synced(chat_id, MESSAGE_STORE_CONSUMER, messages)
+        return len(rows)
 
-            if (
-                (user_id == "" or message.get("from", {}).get("user", {}).get("id") == user_id) and
-                attachments[0].get("contentType") == "messageReference" and
-                attachments[0].get("id") == msg_id
-            ):
-                soup = BeautifulSoup(message['body']['content'], "html.parser")
-
-                for emoji_tag in soup.find_all("emoji"):
-                    if emoji_tag.has_attr("alt"):
-                        emoji_tag.replace_with(emoji_tag["alt"])
-
-
-                text = soup.get_text(separator=' ', strip=True)
-                return text
-
-        return None
\ No newline at end of file
+    def get_replies(self, chat_id, msg_ids):
+        """
+        Load every stored reply to msg_ids with one indexed query.
+        :return: list of (referenced message id, sender id, reply text), newest first
+        """
+        return list(ChatMessage.objects.filter(
+            chat_id=chat_id, reference_id__in=list(msg_ids)
+        ).order_by("-created").values_list("reference_id", "sender_id", "text"))
@@ -1,3 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+
 class TrieNode:
     def __init__(self):
         self.children = {}
@@ -23,4 +28,33 @@ class Trie:
             if char not in node.children:
                 return []
             node = node.children[char]
-        return node.contacts
\ No newline at end of file
+        return node.contacts
+
+
+def _call_and_close_db(fn, item):
+    try:
+        return fn(item)
+    except Exception as e:
+        return e
+    finally:
+        # Django 每個 thread 各自開 DB 連線，執行完要自己關掉，否則會一直佔著
+        connections.close_all()
+
+
+def threaded_map(fn, items, max_workers):
+    """
+    Run fn(item) for every item on a bounded thread pool and return the results in input order.
+    An exception raised by fn is returned in place of its result so one failure does not stop the rest.
+    With max_workers <= 1 everything runs inline on the calling thread.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            try:
+                results.append(fn(item))
+            except Exception as e:
+                results.append(e)
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(lambda item: _call_and_close_db(fn, item), items))
@@ -17,10 +17,15 @@ def get_attendee_data(graph_client: TeamsClient, attendees):
 
     try:
         # Fetch user IDs and chat IDs in bulk
-        user_ids = [
-            graph_client.get_user_info_by_email(email).get('id') 
-            for email in attendees
-        ]
+        users = graph_client.get_users_by_email(attendees)
+        for email in attendees:
+            if email not in users:
+                # batch 中暫時失敗的項目改用單筆查詢
+                users[email] = graph_client.get_user_info_by_email(email)
+        missing = [email for email in attendees if not users.get(email)]
+        if missing:
+            raise ValueError(f"User not found: {', '.join(missing)}")
+        user_ids = [users[email].get('id') for email in attendees]
         chat_ids = graph_client.get_chat_ids(user_ids)
 
         # Combine attendee data
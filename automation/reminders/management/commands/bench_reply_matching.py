@@ -0,0 +1,95 @@
+import random
+import time
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from core.teams_client import html_to_text, index_replies
+
+
+def _linear_search(messages, user_id, msg_id):
+    """
+    The former TeamsClient._search_message_reference: scan the whole list for every msg_id.
+    """
+    for message in messages:
+        attachments = message.get("attachments", [])
+        if not attachments:
+            continue
+        if (
+            (user_id == "" or message.get("from", {}).get("user", {}).get("id") == user_id) and
+            attachments[0].get("contentType") == "messageReference" and
+            attachments[0].get("id") == msg_id
+        ):
+            soup = BeautifulSoup(message['body']['content'], "html.parser")
+            for emoji_tag in soup.find_all("emoji"):
+                if emoji_tag.has_attr("alt"):
+                    emoji_tag.replace_with(emoji_tag["alt"])
+            return soup.get_text(separator=' ', strip=True)
+    return None
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark reply matching for scanAnyMatchMsg on a synthetic chat (no Graph / DB access)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=10000)
+        parser.add_argument("--notifications", type=int, default=200)
+        parser.add_argument("--msg-ids", type=int, default=3, help="bot messages sent per notification")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        owners = [f"user-{i}" for i in range(50)]
+        notifications = [
+            {"owner_id": rng.choice(owners), "msg_id": [f"bot-{n}-{k}" for k in range(options["msg_ids"])]}
+            for n in range(options["notifications"])
+        ]
+        all_msg_ids = [mid for item in notifications for mid in item["msg_id"]]
+
+        messages = []
+        for i in range(options["messages"]):
+            message = {
+                "id": f"m-{i}",
+                "from": {"user": {"id": rng.choice(owners)}},
+                "body": {"content": f"<div><p>message {i} <emoji alt='👍'></emoji></p></div>"},
+                "attachments": [],
+            }
+            # 約 10% 的訊息是回覆機器人發出的通知
+            if rng.random() < 0.1:
+                message["attachments"] = [{"contentType": "messageReference", "id": rng.choice(all_msg_ids)}]
+            messages.append(message)
+
+        start = time.perf_counter()
+        linear = {}
+        for item in notifications:
+            for mid in item["msg_id"]:
+                content = _linear_search(messages, item["owner_id"], mid)
+                if content:
+                    linear[mid] = content
+                    break
+        linear_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = index_replies(
+            (m["attachments"][0]["id"], m["from"]["user"]["id"], m)
+            for m in messages
+            if m["attachments"] and m["attachments"][0].get("contentType") == "messageReference"
+        )
+        indexed = {}
+        for item in notifications:
+            for mid in item["msg_id"]:
+                reply = index.get((mid, item["owner_id"]))
+                if reply:
+                    # 只有命中的回覆才做 HTML -> text
+                    indexed[mid] = " ".join(html_to_text(reply["body"]["content"]).splitlines())
+                    break
+        indexed_elapsed = time.perf_counter() - start
+
+        if linear != indexed:
+            self.stderr.write("⚠️ Results differ between linear scan and index")
+        self.stdout.write(
+            f"{options['messages']} messages, {options['notifications']} notifications x {options['msg_ids']} msg_ids, "
+            f"{len(indexed)} replies matched"
+        )
+        self.stdout.write(f"  linear scan: {linear_elapsed * 1000:.1f} ms")
+        self.stdout.write(f"  hash index : {indexed_elapsed * 1000:.1f} ms")
@@ -0,0 +1,111 @@
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from openpyxl import Workbook
+
+from reminders.sharepoint_client import GraphSharePointClient
+
+# 在獨立的子行程中執行，peak RSS 才不會被前一個模式或 Django 本身影響
+_CHILD_SCRIPT = """
+import json, sys, time
+import pandas as pd
+from reminders.sheet_rules import evaluate_sheet_rules
+from reminders.workbook_reader import iter_xlsx_sheets
+
+mode, path, col_tag = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+sheet_name = json.loads(sys.argv[4])
+start = time.perf_counter()
+if mode == "read_excel":
+    sheets = pd.read_excel(path, sheet_name, na_values=[""], keep_default_na=False)
+    sheets = sheets.items() if isinstance(sheets, dict) else [(sheet_name, sheets)]
+else:
+    with open(path, "rb") as f:
+        content = f.read()
+    sheets = iter_xlsx_sheets(content, sheet_name, min(col_tag.values()), max(col_tag.values()), engine=mode)
+rows = hits = 0
+for name, df in sheets:
+    rows += len(df)
+    hits += len(evaluate_sheet_rules(df, col_tag))
+print(json.dumps({"elapsed": time.perf_counter() - start, "rows": rows, "hits": hits}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Compare time and peak RSS of full read_excel vs streaming xlsx parsing of a feature-tracking workbook."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="xlsx file to parse (omit to generate one with --generate)")
+        parser.add_argument("--sheet", default=None, help="sheet name to parse (default: every sheet)")
+        parser.add_argument("--generate", type=int, default=20000, help="rows per sheet of the generated workbook")
+        parser.add_argument("--sheets", type=int, default=5, help="sheets in the generated workbook")
+        parser.add_argument("--modes", default="read_excel,openpyxl,calamine")
+        parser.add_argument("--repeat", type=int, default=1)
+
+    def handle(self, *args, **options):
+        col_tag = GraphSharePointClient(user_id="bench").col_tag
+        path = options["path"]
+        generated = None
+        if path is None:
+            generated = path = self._generate(options["sheets"], options["generate"], col_tag)
+        elif not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        self.stdout.write(f"{path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+        try:
+            for mode in options["modes"].split(","):
+                for _ in range(options["repeat"]):
+                    self._run(mode.strip(), path, col_tag, options["sheet"])
+        finally:
+            if generated:
+                os.unlink(generated)
+
+    def _run(self, mode, path, col_tag, sheet_name):
+        env = dict(os.environ, PYTHONPATH=str(settings.BASE_DIR))
+        proc = subprocess.Popen(
+            [sys.executable, "-c", _CHILD_SCRIPT, mode, path, json.dumps(col_tag), json.dumps(sheet_name)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        )
+        # wait4 回傳的是這個子行程自己的 rusage（ru_maxrss 在 Linux 上單位是 KB）
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        out, err = proc.stdout.read().decode(), proc.stderr.read().decode()
+        if proc.returncode != 0:
+            last_line = err.strip().splitlines()[-1] if err.strip() else f"exit {proc.returncode}"
+            self.stderr.write(f"{mode:>10}: failed ({last_line})")
+            return
+        result = json.loads(out.strip().splitlines()[-1])
+        self.stdout.write(
+            f"{mode:>10}: {result['elapsed']:.2f}s, peak RSS {usage.ru_maxrss / 1024:.0f} MB, "
+            f"{result['rows']} rows, {result['hits']} hits"
+        )
+
+    def _generate(self, sheets, rows, col_tag):
+        """A write-only workbook shaped like the feature to-do list, with extra columns past M."""
+        rng = random.Random(0)
+        today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        width = max(col_tag.values()) + 8
+        wb = Workbook(write_only=True)
+        for s in range(sheets):
+            ws = wb.create_sheet(f"Sprint {s}")
+            ws.append([f"Column {i}" for i in range(width)])
+            for r in range(rows):
+                row = [f"note {r}-{i}" for i in range(width)]
+                row[col_tag["status"]] = rng.choice(["Done", "WIP", "N/A", None])
+                row[col_tag["task"]] = rng.choice([f"Feature {r}", None])
+                row[col_tag["owner"]] = rng.choice(["someone@zyxel.com.tw", "someone", None])
+                row[col_tag["estimate_start_date"]] = today + datetime.timedelta(days=rng.randint(-30, 30))
+                row[col_tag["estimate_days"]] = rng.randint(1, 10)
+                row[col_tag["due_date"]] = rng.choice([today + datetime.timedelta(days=rng.randint(-30, 30)), None])
+                row[col_tag["teams_group_name"]] = "Sprint group"
+                ws.append(row)
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        wb.save(path)
+        return path
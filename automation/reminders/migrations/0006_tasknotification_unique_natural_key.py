@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+NATURAL_KEY = ('host_id', 'site_name', 'drive_name', 'file_path', 'sheet_name', 'row', 'reason')
+
+
+def remove_duplicate_notifications(apps, schema_editor):
+    """
+    Keep only the newest TaskNotification per natural key so the unique constraint can be added.
+    """
+    TaskNotification = apps.get_model('reminders', 'TaskNotification')
+    seen = set()
+    duplicates = []
+    for pk, *key in TaskNotification.objects.order_by('-created_at', '-pk').values_list('pk', *NATURAL_KEY):
+        key = tuple(key)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    TaskNotification.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0005_taskmanager_periodic_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_notifications, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tasknotification',
+            constraint=models.UniqueConstraint(fields=('host_id', 'site_name', 'drive_name', 'file_path', 'sheet_name', 'row', 'reason'), name='unique_task_notification'),
+        ),
+    ]
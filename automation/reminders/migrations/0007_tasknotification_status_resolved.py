@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0006_tasknotification_unique_natural_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasknotification',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('SENT', 'Sent'), ('FAILED', 'Failed'), ('COMPLETED', 'Completed'), ('RESOLVED', 'Resolved')], default='PENDING', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0007_tasknotification_status_resolved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasknotification',
+            name='digest_positions',
+            field=models.JSONField(default=dict),
+        ),
+    ]
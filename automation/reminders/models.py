@@ -2,6 +2,9 @@ from django.db import models
 import uuid
 from django_celery_beat.models import PeriodicTask
 
+# 同一個 host 對同一份檔案、同一列、同一原因只會有一筆通知
+TASK_NOTIFICATION_NATURAL_KEY = ["host_id", "site_name", "drive_name", "file_path", "sheet_name", "row", "reason"]
+
 # Create your models here.
 # 舊的
 class TaskNotification(models.Model):
@@ -10,6 +13,10 @@ class TaskNotification(models.Model):
         SENT = "SENT", "Sent"
         FAILED = "FAILED", "Failed"
         COMPLETED = "COMPLETED", "Completed"
+        RESOLVED = "RESOLVED", "Resolved"  # 問題已在表單上被修正，不再需要通知
+
+    # 不需要再通知或掃描回覆的狀態
+    CLOSED_STATUSES = [Status.COMPLETED, Status.RESOLVED]
 
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)  # 新增 UUID 欄位
     site_name = models.CharField(max_length=255)
@@ -26,6 +33,8 @@ class TaskNotification(models.Model):
     field_address = models.CharField(max_length=255)
     reason = models.CharField(max_length=255)
     msg_id = models.JSONField(default=list)
+    # digest 訊息 id -> 這個通知在該訊息中的編號；回覆 digest 時只認「#編號 內容」
+    digest_positions = models.JSONField(default=dict)
     status = models.CharField(
         max_length=20,
         choices=Status.choices,
@@ -34,6 +43,16 @@ class TaskNotification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     host_id = models.CharField(max_length=255)
 
+    NATURAL_KEY = TASK_NOTIFICATION_NATURAL_KEY
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=TASK_NOTIFICATION_NATURAL_KEY,
+                name="unique_task_notification",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.sheet_name} - Row {self.row}: {self.task}"
 
@@ -1,11 +1,66 @@
-from core.teams_client import TeamsClient
-from urllib.parse import quote
+from core.teams_client import TeamsClient, index_replies
+from urllib.parse import quote, unquote
 import pandas as pd
-from io import BytesIO
 from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string
 from .models import TaskNotification, TaskManager
-from concurrent.futures import ThreadPoolExecutor
+from .sheet_rules import evaluate_sheet_rules
+from .workbook_reader import frame_from_chunks, iter_xlsx_sheets
+from core.utils import threaded_map
 from collections import defaultdict
+from functools import cached_property
+from django.db import transaction
+from django.conf import settings
+from pathlib import Path
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+# 重新標記時會被覆寫的欄位（uuid / msg_id / created_at 保留）
+NOTIFY_ITEM_UPDATE_FIELDS = [
+    "task", "teams_group_name", "teams_group_id", "owner_id", "owner_email", "owner_name",
+    "field_address", "status",
+]
+
+# 同時掃描幾個聊天室（每個都會打 Graph 同步訊息，速率由共用 token bucket 控制）
+SCAN_CONCURRENCY = getattr(settings, 'REMINDERS_SCAN_CONCURRENCY', 4)
+
+# digest 模式下一則訊息最多列出幾個通知，避免訊息過長
+DIGEST_MAX_ITEMS = getattr(settings, 'REMINDERS_DIGEST_MAX_ITEMS', 20)
+
+# 解析後的工作表快取（以 driveItem id + cTag/eTag 為 key），內容沒變就不重新下載
+# 快取是 pickle，讀取時等同執行程式碼，所以放在 app 自己的目錄並限制只有本帳號可讀寫（0700）
+WORKBOOK_CACHE_DIR = Path(getattr(
+    settings, 'REMINDERS_WORKBOOK_CACHE_DIR', Path(settings.BASE_DIR) / ".cache" / "workbooks"
+))
+
+# 檔案超過這個大小（bytes）就改用 workbook API 只讀需要的欄位，不下載整個 xlsx
+RANGE_READ_MIN_BYTES = getattr(settings, 'REMINDERS_RANGE_READ_MIN_BYTES', 5 * 1024 * 1024)
+# range read 每次請求的列數，避免單一 response 過大
+RANGE_READ_CHUNK_ROWS = getattr(settings, 'REMINDERS_RANGE_READ_CHUNK_ROWS', 5000)
+# 下載整個檔案時用的 xlsx 解析器：auto（有裝 python-calamine 就用）/ calamine / openpyxl
+XLSX_ENGINE = getattr(settings, 'REMINDERS_XLSX_ENGINE', 'auto')
+
+# digest 回覆中的一行「#2 已完成」、「2: 已完成」、「2. 已完成」；Teams 會把「1. 」開頭自動轉成清單而吃掉編號，所以建議用 #
+_NUMBERED_REPLY_RE = re.compile(r'^\s*(?:#\s*(\d+)\s*[:：.、)\-]?|(\d+)\s*[:：.、)\-])\s*(.*)$')
+
+def parse_numbered_replies(text):
+    """
+    Split a reply to a digest message into per-item answers.
+    Lines without a number continue the previous numbered answer; text before the first number is ignored.
+    :return: dict of item number -> answer text (items without text are left out)
+    """
+    answers, current = {}, None
+    for line in (text or "").splitlines():
+        match = _NUMBERED_REPLY_RE.match(line)
+        if match:
+            current = int(match.group(1) or match.group(2))
+            answers[current] = match.group(3).strip()
+        elif current is not None and line.strip():
+            answers[current] = f"{answers[current]} {line.strip()}".strip()
+    return {number: answer for number, answer in answers.items() if answer}
 
 def get_excel_col(col_idx_zero_based):
     """將從0開始的index轉為Excel欄位字母（自動+1）"""
@@ -17,10 +72,8 @@ class GraphSharePointClient(TeamsClient):
         self.path = quote(path)
         self.site_name = site_name
         self.drive_name = drive_name
-        self.site_id = self._get_site_id(site_name=site_name)
-        self.list_id = self._get_list_id()
-        self.drive_id = self._get_drive_id()
         self.notify_interval = None
+        self._owner_cache = {}  # owner email -> Graph user（None 代表查無此人）
 
         # column index for the template sheet
         self.col_tag = {
@@ -28,26 +81,35 @@ class GraphSharePointClient(TeamsClient):
         }
         self.col_letter = {k:v for k, v in zip(self.col_tag.keys(), map(get_excel_col, self.col_tag.values()))}
 
-    # def _get_site_id(self):
-    #     url = f"/sites/{self.domain}:/sites/{self.site_name}"
-    #     self.site_id = self._send_request(url).json().get("id")
-    #     return self.site_id
+    # site / list / drive id 只在第一次用到時才查詢，建立 client 本身不打 Graph API
+    @cached_property
+    def site_id(self):
+        return self._get_site_id(self.site_name)
+
+    @cached_property
+    def list_id(self):
+        return self._get_list_id()
+
+    @cached_property
+    def drive_id(self):
+        return self._get_drive_id()
+
+    def _invalidate_resolved_ids(self):
+        super()._invalidate_resolved_ids()
+        for attr in ("site_id", "list_id", "drive_id"):
+            self.__dict__.pop(attr, None)
 
     def _get_drive_id(self):
-        url = f"/sites/{self._get_site_id(self.site_name)}/drives"
-        for drive in self._send_request(url).json()["value"]:
-            if drive["name"] == self.drive_name:
-                self._drive_id = drive["id"]
-                return self._drive_id
-        raise Exception(f"Drive {self.drive_name} not found")
+        return self._get_site_and_drive_id(self.site_name, self.drive_name)[1]
     
     def _get_list_id(self, drive_name="ScrumSprints"):
-        url = f"/sites/{self._get_site_id(self.site_name)}/lists"
-        for lst in self._send_request(url).json()["value"]:
-            if lst["displayName"] == drive_name:
-                self._list_id = lst.get("id")
-                return self._list_id
-        raise Exception(f"List with name '{drive_name}' not found")
+        def resolve():
+            url = f"/sites/{self.site_id}/lists"
+            for lst in self._send_request(url).json()["value"]:
+                if lst["displayName"] == drive_name:
+                    return lst.get("id")
+            raise Exception(f"List with name '{drive_name}' not found")
+        return self._resolve_cached(("list", self.domain, self.site_name, drive_name), resolve)
 
     # for download file usage
     def _build_drive_url(self):
@@ -60,35 +122,269 @@ class GraphSharePointClient(TeamsClient):
     def _build_excel_range_url(self, sheet, address):
         return f"{self._build_list_url()}:/workbook/worksheets('{sheet}')/range(address='{address}')"
     
-    # return a dict with sheet name as key and DataFrame as value
-    def _download_excel_as_df(self, sheet_name=None, file_type="xlsx"):
-        url = f"{self._build_drive_url()}:/content"
-        res = self._send_request(url)
-        if res.status_code != 200:
-            raise Exception(f"Download failed: {res.status_code} {res.text}")
-        if file_type in ["xls", "xlsx"]:
-            return pd.read_excel(BytesIO(res.content), sheet_name, na_values=[""], keep_default_na=False)
+    def _build_worksheet_url(self, sheet):
+        # OData 字串中的單引號要寫成兩個
+        escaped = quote(sheet.replace("'", "''"), safe="")
+        return f"{self._build_drive_url()}:/workbook/worksheets('{escaped}')"
+
+    def _list_worksheet_names(self):
+        url = f"{self._build_drive_url()}:/workbook/worksheets"
+        return [ws["name"] for ws in self._send_request(url, params={"$select": "name"}).json()["value"]]
+
+    def _iter_sheet_range(self, sheet, first_col, last_col, chunk_rows=None):
+        """
+        Yield the values of columns first_col..last_col (0-based) of a worksheet, from row 1 to the
+        last used row, in chunks of at most chunk_rows rows, through the workbook range API.
+        """
+        chunk_rows = chunk_rows or RANGE_READ_CHUNK_ROWS
+        sheet_url = self._build_worksheet_url(sheet)
+        used = self._send_request(
+            f"{sheet_url}/usedRange(valuesOnly=true)", params={"$select": "address,rowIndex,rowCount"}
+        ).json()
+        last_row = used["rowIndex"] + used["rowCount"]
+        start_letter, end_letter = get_excel_col(first_col), get_excel_col(last_col)
+        for start in range(1, last_row + 1, chunk_rows):
+            end = min(start + chunk_rows - 1, last_row)
+            address = f"{start_letter}{start}:{end_letter}{end}"
+            res = self._send_request(f"{sheet_url}/range(address='{address}')", params={"$select": "values"})
+            yield res.json()["values"]
+
+    def _read_sheet_range(self, sheet):
+        """
+        Range-read counterpart of pd.read_excel for one sheet: only the col_tag columns are fetched
+        and date columns are converted from the Excel serial numbers the API returns. Each chunk of
+        rows is turned into a DataFrame as it arrives, so the raw JSON of at most one chunk is kept.
+        """
+        first_col, last_col = min(self.col_tag.values()), max(self.col_tag.values())
+        date_cols = (self.col_tag["estimate_start_date"], self.col_tag["due_date"])
+        return frame_from_chunks(
+            self._iter_sheet_range(sheet, first_col, last_col), first_col, serial_date_cols=date_cols
+        )
+
+    def _iter_workbook_range(self, sheet_name=None):
+        """
+        Yield (sheet name, DataFrame) for the selected sheets (a name, a list, or None for all),
+        built from range reads instead of the whole file.
+        """
+        if isinstance(sheet_name, str):
+            names = [sheet_name]
         else:
-            raise ValueError("Unsupported file type")
-
-    def _write_cell(self, uuid, values):
-        task = TaskNotification.objects.get(uuid=uuid)
-        url = self._build_excel_range_url(task.sheet_name, task.field_address)
-        payload = {"values": values}
-        self._send_request(endpoint=url, method="POST",json=payload)
-        print("✅ Updated")
-        task.status = TaskNotification.Status.COMPLETED
-        task.save()
-    
-    def _create_notify_item(self, context: dict, reason: str, field: str):
+            names = self._list_worksheet_names() if sheet_name is None else sheet_name
+        for name in names:
+            yield name, self._read_sheet_range(name)
+
+    def _iter_workbook_download(self, sheet_name=None):
+        """
+        Download the whole file, then stream-parse it sheet by sheet keeping only the col_tag columns.
+        """
+        res = self._send_request(f"{self._build_drive_url()}:/content")
+        first_col, last_col = min(self.col_tag.values()), max(self.col_tag.values())
+        yield from iter_xlsx_sheets(res.content, sheet_name, first_col, last_col, engine=XLSX_ENGINE)
+
+    def _get_item_metadata(self):
+        """
+        Lightweight driveItem lookup used to decide whether the workbook changed.
+        """
+        return self._send_request(
+            self._build_drive_url(),
+            params={"$select": "id,eTag,cTag,lastModifiedDateTime,size"}
+        ).json()
+
+    @staticmethod
+    def _ensure_private_cache_dir():
+        """
+        Create WORKBOOK_CACHE_DIR with mode 0700 and check that only this account can write to it.
+        :return: True when the cache can be used safely
+        """
+        try:
+            WORKBOOK_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            st = WORKBOOK_CACHE_DIR.stat()
+            if st.st_uid == os.getuid() and st.st_mode & 0o077:
+                os.chmod(WORKBOOK_CACHE_DIR, 0o700)
+                st = WORKBOOK_CACHE_DIR.stat()
+        except OSError as e:
+            print(f"⚠️ Workbook cache disabled, cannot prepare {WORKBOOK_CACHE_DIR}: {e}")
+            return False
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            print(f"⚠️ Workbook cache disabled, {WORKBOOK_CACHE_DIR} is not private to this user")
+            return False
+        return True
+
+    def _workbook_cache_dir(self, item_id, tag, sheet_name):
+        tag_digest = hashlib.sha1(tag.encode("utf-8")).hexdigest()[:16]
+        sheet_digest = hashlib.sha1(str(sheet_name).encode("utf-8")).hexdigest()[:16]
+        return WORKBOOK_CACHE_DIR / f"{item_id}-{tag_digest}-{sheet_digest}"
+
+    def _iter_workbook(self, sheet_name=None):
+        """
+        Lazily yield (sheet name, DataFrame) for the selected sheets, one sheet at a time.
+
+        Parsed sheets are cached on local disk keyed by driveItem id + cTag (eTag as fallback), one
+        pickle per sheet, so an unchanged workbook costs one metadata call. Workbooks of at least
+        RANGE_READ_MIN_BYTES are read through the workbook range API, smaller ones are downloaded.
+        """
+        meta = self._get_item_metadata()
+        if (meta.get("size") or 0) >= RANGE_READ_MIN_BYTES:
+            read = self._iter_workbook_range
+        else:
+            read = self._iter_workbook_download
+        item_id, tag = meta.get("id"), meta.get("cTag") or meta.get("eTag")
+        if not item_id or not tag or not self._ensure_private_cache_dir():
+            yield from read(sheet_name=sheet_name)
+            return
+
+        cache_dir = self._workbook_cache_dir(item_id, tag, sheet_name)
+        done = set()
+        if cache_dir.is_dir():
+            try:
+                for path in sorted(cache_dir.glob("*.pkl")):
+                    name, df = pd.read_pickle(path)
+                    done.add(name)
+                    yield name, df
+                return
+            except Exception as e:
+                print(f"⚠️ Ignoring unreadable workbook cache {cache_dir}: {e}")
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
+        tmp_dir = None
+        try:
+            # 同一檔案舊版本（不同 tag）的快取已失效，先清掉
+            current_prefix = cache_dir.name.rsplit("-", 1)[0]
+            for old_path in WORKBOOK_CACHE_DIR.glob(f"{item_id}-*"):
+                if not old_path.name.startswith(current_prefix + "-"):
+                    if old_path.is_dir():
+                        shutil.rmtree(old_path, ignore_errors=True)
+                    else:
+                        old_path.unlink(missing_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(dir=WORKBOOK_CACHE_DIR, prefix=f"{current_prefix}-tmp"))
+        except OSError as e:
+            print(f"⚠️ Failed to cache workbook {item_id}: {e}")
+
+        try:
+            for idx, (name, df) in enumerate(read(sheet_name=sheet_name)):
+                if tmp_dir is not None:
+                    try:
+                        pd.to_pickle((name, df), tmp_dir / f"{idx:04d}.pkl")
+                    except OSError as e:
+                        print(f"⚠️ Failed to cache workbook {item_id}: {e}")
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                        tmp_dir = None
+                if name not in done:
+                    yield name, df
+            # 全部工作表都寫完才換上正式目錄，避免留下不完整的快取
+            if tmp_dir is not None:
+                try:
+                    os.rename(tmp_dir, cache_dir)
+                    tmp_dir = None
+                except OSError:
+                    pass  # 其他 worker 已經寫好同一份快取
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _create_workbook_session(self):
+        """
+        Open a persistent workbook session so several writes reuse one server-side workbook.
+        :return: session id, or None when the session could not be created (writes go sessionless)
+        """
+        try:
+            res = self._send_request(
+                f"{self._build_list_url()}:/workbook/createSession", method="POST", json={"persistChanges": True}
+            )
+            return res.json()["id"]
+        except Exception as e:
+            print(f"⚠️ Failed to create workbook session, writing without one: {e}")
+            return None
+
+    def _close_workbook_session(self, session_id):
+        try:
+            self._send_request(
+                f"{self._build_list_url()}:/workbook/closeSession", method="POST",
+                headers={"workbook-session-id": session_id}
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to close workbook session: {e}")
+
+    @staticmethod
+    def _group_contiguous_cells(cells):
+        """
+        Group {address: value} into runs of vertically adjacent cells of the same column.
+        :return: list of (range address, 2D values, cell addresses), e.g. ("F3:F5", [[a], [b], [c]], [...])
+        """
+        by_column = defaultdict(list)
+        for address, value in cells.items():
+            column, row = coordinate_from_string(address)
+            by_column[column].append((row, address, value))
+        groups = []
+        for column, entries in by_column.items():
+            entries.sort()
+            run = [entries[0]]
+            for entry in entries[1:] + [None]:
+                if entry is not None and entry[0] == run[-1][0] + 1:
+                    run.append(entry)
+                    continue
+                first, last = run[0][0], run[-1][0]
+                address = f"{column}{first}" if first == last else f"{column}{first}:{column}{last}"
+                groups.append((address, [[value] for _, _, value in run], [cell for _, cell, _ in run]))
+                run = [entry]
+        return groups
+
+    def _write_replies(self, sheet_name, replies):
+        """
+        Write Teams replies back into one sheet, one PATCH per run of adjacent cells, then mark
+        the written notifications COMPLETED with one bulk update. Several runs share one persistent
+        workbook session; a single run is one sessionless PATCH.
+        :param replies: list of (TaskNotification, reply text)
+        :return: number of notifications completed
+        """
+        cells, owners = {}, defaultdict(list)
+        for task, content in replies:
+            cells[task.field_address] = content
+            owners[task.field_address].append(task.pk)
+
+        runs = self._group_contiguous_cells(cells)
+        # session 要多兩次呼叫（create / close），只有一個 PATCH 時不划算
+        session_id = self._create_workbook_session() if len(runs) > 1 else None
+        headers = {"workbook-session-id": session_id} if session_id else None
+        written = []
+        try:
+            for address, values, addresses in runs:
+                try:
+                    self._send_request(
+                        self._build_excel_range_url(sheet_name, address), method="PATCH",
+                        json={"values": values}, headers=headers
+                    )
+                except Exception as e:
+                    print(f"❌ Failed to write {sheet_name}!{address}: {e}")
+                    continue
+                for cell in addresses:
+                    written.extend(owners[cell])
+        finally:
+            if session_id:
+                self._close_workbook_session(session_id)
+
+        TaskNotification.objects.filter(pk__in=written).update(status=TaskNotification.Status.COMPLETED)
+        print(f"✅ Updated {len(written)} replies in sheet {sheet_name}")
+        return len(written)
+
+    def _client_for_file(self, site_name, drive_name, file_path):
+        # file_path 存的是 quote 過的路徑
+        if (site_name, drive_name, file_path) == (self.site_name, self.drive_name, self.path):
+            return self
+        return GraphSharePointClient(self.user_id, site_name, drive_name, unquote(file_path))
+
+    def _build_notify_item(self, context: dict, reason: str, field: str):
         # Retrieve owner information
         owner_email = context.get("owner")
         user_info = {}
-        if not pd.isna(owner_email):
-            user_info = self.get_user_info_by_email(owner_email) if owner_email else {}
-        # Prepare default values for the notification
-        defaults = {
-            "host_id": self.me['id'],
+        if not pd.isna(owner_email) and owner_email:
+            if owner_email in self._owner_cache:
+                user_info = self._owner_cache[owner_email] or {}
+            elif "@" in str(owner_email):
+                user_info = self.get_user_info_by_email(owner_email)
+        # Field values of the notification
+        return {
+            "host_id": self.user_id,
             "site_name": self.site_name,
             "drive_name": self.drive_name,
             "file_path": self.path,
@@ -102,107 +398,73 @@ class GraphSharePointClient(TeamsClient):
             "owner_name": user_info.get("displayName"),
             "field_address": field,
             "reason": reason,
+            "status": TaskNotification.Status.PENDING,
         }
 
-        # Check for existing notification item
-        try:
-            existing_item = TaskNotification.objects.filter(
+    def _upsert_notify_items(self, sheet_name, items):
+        """
+        Write the notifications computed for one sheet: one query loads the existing rows,
+        then new and changed rows are written with bulk_create / bulk_update in one transaction.
+        Existing rows that are flagged again are reset to PENDING, as before, and open rows
+        that are no longer flagged are marked RESOLVED (see _reconcile_notify_items).
+        :return: dict with created / updated / unchanged / resolved counts
+        """
+        existing = {
+            (n.row, n.reason): n
+            for n in TaskNotification.objects.filter(
+                host_id=self.user_id,
                 site_name=self.site_name,
                 drive_name=self.drive_name,
                 file_path=self.path,
-                sheet_name=context["sheet_name"],
-                row=context["row_idx"],
-                reason=reason,
-                host_id=self.me['id'],
-            ).first()
-
-            if existing_item:
-                # Update the existing item
-                for key, value in defaults.items():
-                    setattr(existing_item, key, value)
-                existing_item.status = TaskNotification.Status.PENDING
-                existing_item.save()
-                print(f"🔄 Notification updated for task: {context['task']}, reason: {reason}")
-            else:
-                # Create a new notification item
-                obj = TaskNotification.objects.create(**defaults)
-                obj.save()
-                print(f"✅ Notification created for task: {context['task']}, reason: {reason}")
-        except Exception as e:
-            print(f"❌ Failed to create or update notification for task: {context['task']}\n{e}")
-    
-    def _process_row(self, row, row_idx, sheet_name, teams_group_name, teams_group_id):
-        if row_idx == 0:
-            # 標題列
-            return
-        
-        task = row.iloc[self.col_tag["task"]]
-        if pd.isna(task):
-            # 確認有無任務名稱
-            return
-        
-        context = {
-            "sheet_name": sheet_name,
-            "row_idx": row_idx+2,
-            "task": task,
-            "owner": row.iloc[self.col_tag["owner"]],
-            "teams_group_name": teams_group_name,
-            "teams_group_id": teams_group_id,
+                sheet_name=sheet_name,
+            )
         }
+        to_create, to_update = [], []
+        for values in items:
+            obj = existing.get((values["row"], values["reason"]))
+            if obj is None:
+                to_create.append(TaskNotification(**values))
+            elif any(getattr(obj, key) != value for key, value in values.items()):
+                for key, value in values.items():
+                    setattr(obj, key, value)
+                to_update.append(obj)
 
-        if str(row.iloc[self.col_tag["status"]]).lower() == "done" or str(row.iloc[self.col_tag["status"]]).lower() == "n/a" :
-            # 如果狀態是完成，或是na，則不需要通知
-            return
-        
-        # owner沒有或是不是email格式 發通知（不用繼續往下檢查其他條件）
-        if pd.isna(context["owner"]):
-            self._create_notify_item(
-                context,
-                reason="Owner is missing",
-                field=f"{self.col_letter["owner"]}{row_idx}"
+        with transaction.atomic():
+            # update_conflicts：另一個 worker 同時建立同一筆時改為更新，不會重複
+            TaskNotification.objects.bulk_create(
+                to_create,
+                update_conflicts=True,
+                unique_fields=TaskNotification.NATURAL_KEY,
+                update_fields=NOTIFY_ITEM_UPDATE_FIELDS,
             )
-            return
-        elif "@" not in context["owner"]:
-            self._create_notify_item(
-                context,
-                reason="Owner is not valid email",
-                field=f"{self.col_letter["owner"]}{row_idx}"
-            )
-            return
-        
-        today = pd.Timestamp.now().normalize()
-        def to_dt_safe(val):
-            return pd.to_datetime(val, errors='coerce')
-        estimate_start_date = row.iloc[self.col_tag["estimate_start_date"]]
-        estimate_start_date_dt = to_dt_safe(estimate_start_date)
-
-        if pd.isna(estimate_start_date):
-            self._create_notify_item(
-                context,
-                reason="Estimate start date is missing",
-                field=f"{self.col_letter["estimate_start_date"]}{row_idx}"
-            )
-        elif abs((estimate_start_date_dt - today).days) == 1:
-            self._create_notify_item(
-                context,
-                reason="Estimated start date is within one day of today",
-                field=f"{self.col_letter["estimate_start_date"]}{row_idx}"
+            TaskNotification.objects.bulk_update(to_update, NOTIFY_ITEM_UPDATE_FIELDS)
+            resolved = self._reconcile_notify_items(
+                existing, {(values["row"], values["reason"]) for values in items}
             )
+        counts = {
+            "created": len(to_create),
+            "updated": len(to_update),
+            "unchanged": len(items) - len(to_create) - len(to_update),
+            "resolved": resolved,
+        }
+        print(f"✅ Notifications for sheet {sheet_name}: {counts}")
+        return counts
 
-        due_date = row.iloc[self.col_tag["due_date"]]
-        due_date_dt = to_dt_safe(due_date)
-        if pd.isna(due_date):
-            self._create_notify_item(
-                context,
-                reason="Due date is missing",
-                field=f"{self.col_letter["due_date"]}{row_idx}"
-            )
-        elif abs((due_date_dt - today).days) == 1:
-            self._create_notify_item(
-                context,
-                reason="Due date is within one day of today",
-                field=f"{self.col_letter["due_date"]}{row_idx}"
-            )
+    def _reconcile_notify_items(self, existing, live_keys):
+        """
+        Mark open notifications whose (row, reason) is no longer flagged in the sheet as RESOLVED,
+        so later notify runs only fan out messages for live issues.
+        :param existing: dict of (row, reason) -> TaskNotification loaded for the sheet
+        :param live_keys: set of (row, reason) found by the current scan
+        :return: number of notifications resolved
+        """
+        stale = [
+            n.pk for key, n in existing.items()
+            if key not in live_keys and n.status not in TaskNotification.CLOSED_STATUSES
+        ]
+        if not stale:
+            return 0
+        return TaskNotification.objects.filter(pk__in=stale).update(status=TaskNotification.Status.RESOLVED)
 
     def _process_sheet(self, df, sheet_name):
         # 檢查有無 teams_group_name 欄位
@@ -211,12 +473,36 @@ class GraphSharePointClient(TeamsClient):
         except Exception as e:
             print(e)
             return
+        # 串流 / range read 都會補齊到 col_tag 最後一欄，較窄的工作表讀到的是空值，不會再丟 IndexError
+        if pd.isna(teams_group_name) or not str(teams_group_name).strip():
+            print(f"⚠️ Sheet {sheet_name} has no teams group name, skipped")
+            return
         teams_group_id = self.get_chat_id_by_name(teams_group_name)
-        # with ThreadPoolExecutor() as executor:
-        #     for row_idx, row in df.iterrows():
-        #         executor.submit(self._process_row, row, row_idx, sheet_name, teams_group_name, teams_group_id)
-        for row_idx, row in df.iterrows():
-            self._process_row(row, row_idx, sheet_name, teams_group_name, teams_group_id)
+        # 整張表一次用向量化規則判斷，只留下需要通知的 (row, reason, field)
+        hits = evaluate_sheet_rules(df, self.col_tag)
+        tasks = df.iloc[:, self.col_tag["task"]]
+        owners = df.iloc[:, self.col_tag["owner"]]
+        # 先用 $batch 一次查好被標記列的負責人，避免每一列各自打一次 API
+        flagged_owners = {str(owners.iat[hit.row]) for hit in hits if not pd.isna(owners.iat[hit.row])}
+        self._owner_cache.update(self.get_users_by_email(
+            [owner for owner in flagged_owners if "@" in owner and owner not in self._owner_cache]
+        ))
+        items = []
+        for hit in hits:
+            context = {
+                "sheet_name": sheet_name,
+                "row_idx": hit.row + 2,
+                "task": tasks.iat[hit.row],
+                "owner": owners.iat[hit.row],
+                "teams_group_name": teams_group_name,
+                "teams_group_id": teams_group_id,
+            }
+            items.append(self._build_notify_item(
+                context,
+                reason=hit.reason,
+                field=f"{self.col_letter[hit.field]}{hit.row}"
+            ))
+        return items
 
     def _create_mention_message_payload(self, task: TaskNotification):
         if task.owner_email:
@@ -265,15 +551,18 @@ class GraphSharePointClient(TeamsClient):
         # 更新最新資料 
         self.scanAnyMatchMsg()
         # sheet_name=None代表下載所有工作表，前端需要增加一個可以選擇sheet name
-        sheets = self._download_excel_as_df(sheet_name=sheet_name)
-        # 處理excel檔案中所有的row，並存到task notification
-        if sheet_name is not None:
-            # 處理單一工作表
-            self._process_sheet(sheets, sheet_name)
-        else:
-            # 處理多個工作表
-            for name, df in sheets.items():
-                self._process_sheet(df, name)
+        # 處理excel檔案中所有的row，並存到task notification（一次只在記憶體保留一張工作表）
+        counts = defaultdict(int)
+        for name, df in self._iter_workbook(sheet_name=sheet_name):
+            items = self._process_sheet(df, name)
+            if items is None:
+                continue
+            for key, value in self._upsert_notify_items(name, items).items():
+                counts[key] += value
+        print(
+            f"📊 Notifications created={counts['created']} updated={counts['updated']} "
+            f"unchanged={counts['unchanged']} resolved={counts['resolved']}"
+        )
         # 創建任務，signal給celery，只允許一份excel檔一個通知人，避免反覆提醒
         task,created = TaskManager.objects.update_or_create(
             site_name=self.site_name,
@@ -281,12 +570,81 @@ class GraphSharePointClient(TeamsClient):
             file_path=self.path,
             sheet_name=sheet_name,
             defaults={
-                "host_id": self.me['id'],
+                "host_id": self.user_id,
                 "notify_interval": self.notify_interval
             }
         )
         return task
 
+    def _create_digest_message_payload(self, tasks):
+        """
+        One message covering several notifications of the same owner in the same chat.
+        """
+        items = "".join(
+            f"<p><b>#{number}</b> 📄 <b>{task.sheet_name}</b> · 📝 {task.task} · ⚠️ {task.reason}</p>"
+            for number, task in enumerate(tasks, start=1)
+        )
+        # 每一項都要有自己的答覆才會寫回 SharePoint，不能一則回覆套用到所有項目
+        how_to_reply = (
+            "<p>💬 <i>(Reply to this message with one line per item, e.g. <b>#1 done</b>. "
+            "Only numbered answers are recorded to SharePoint.)</i></p>"
+        )
+        owner = tasks[0]
+        if owner.owner_email:
+            return {
+                "body": {
+                    "contentType": "html",
+                    "content": (
+                        f"<div>"
+                        f"<p>👋 <at id=\"0\">{owner.owner_name}</at>, please reply to this message.</p>"
+                        f"{how_to_reply}"
+                        f"<p>{len(tasks)} items need your attention:</p>"
+                        f"{items}"
+                        f"</div>"
+                    )
+                },
+                "mentions": [{
+                    "id": 0,  # Must match <at id="0"> in content
+                    "mentionText": owner.owner_name,
+                    "mentioned": {"user": {"id": owner.owner_id, "displayName": owner.owner_name}},
+                }],
+            }
+        return {
+            "body": {
+                "contentType": "html",
+                "content": f"<div>{how_to_reply}<p>{len(tasks)} items need attention:</p>{items}</div>",
+            },
+        }
+
+    def notify_digest(self, tasks):
+        """
+        Send one Teams message per (chat, owner) instead of one per notification.
+        The message id is appended to every notification it covers together with the item's number
+        in the message, so scanAnyMatchMsg only takes the numbered answer of each item from a reply.
+        :return: number of messages sent
+        """
+        groups = defaultdict(list)
+        for task in tasks:
+            groups[(task.teams_group_id, task.owner_id)].append(task)
+        sent = 0
+        for (chat_id, _), group in groups.items():
+            for start in range(0, len(group), DIGEST_MAX_ITEMS):
+                chunk = group[start:start + DIGEST_MAX_ITEMS]
+                # 單一通知就沿用原本的訊息格式
+                if len(chunk) == 1:
+                    payload = self._create_mention_message_payload(chunk[0])
+                else:
+                    payload = self._create_digest_message_payload(chunk)
+                msg_id = self.send_message_to_chat(chat_id, payload)
+                for number, task in enumerate(chunk, start=1):
+                    task.msg_id.append(msg_id)
+                    if len(chunk) > 1:
+                        task.digest_positions[msg_id] = number
+                    task.status = TaskNotification.Status.SENT
+                TaskNotification.objects.bulk_update(chunk, ["msg_id", "digest_positions", "status"])
+                sent += 1
+        return sent
+
     def notify(self, task:TaskNotification):
         # 發送 Teams 通知
         payload = self._create_mention_message_payload(
@@ -297,12 +655,42 @@ class GraphSharePointClient(TeamsClient):
         task.status = TaskNotification.Status.SENT
         task.save()
     # scan notify items and if matched then update the cell and task status in db
+    def _scan_chat(self, group):
+        """
+        Sync one chat's new messages into the store and return the (notification, reply text) pairs found.
+        :param group: (chat_id, notifications of that chat)
+        """
+        chat_id, items = group
+        # Sync only messages newer than the last sync into the store
+        self.sync_chat_messages(chat_id)
+        # Index every reply to our messages in this chat once, then match each msg_id in O(1)
+        replies = self.get_replies(chat_id, {mid for item in items for mid in item.msg_id})
+        reply_index = index_replies(replies)
+        # A digest covers several cells, so a reply to it only counts for the items it numbers
+        digest_ids = {mid for item in items for mid in item.digest_positions}
+        digest_answers = {}
+        for reference_id, sender_id, text in replies:
+            if reference_id in digest_ids:
+                for number, answer in parse_numbered_replies(text).items():
+                    digest_answers.setdefault((reference_id, sender_id, number), answer)
+        found = []
+        for item in items:
+            for mid in item.msg_id:
+                if mid in item.digest_positions:
+                    reply = digest_answers.get((mid, item.owner_id, item.digest_positions[mid]))
+                else:
+                    reply = reply_index.get((mid, item.owner_id))
+                if reply:
+                    found.append((item, " ".join(reply.splitlines())))
+                    break  # only process first found reply
+        return found
+
     def scanAnyMatchMsg(self):
         # 1. Load all notification records
         notifications = TaskNotification.objects.filter(
-            host_id=self.me['id']
+            host_id=self.user_id
         ).exclude(
-            status=TaskNotification.Status.COMPLETED
+            status__in=TaskNotification.CLOSED_STATUSES
         )
         if len(notifications) == 0:
             print("No pending notifications found.")
@@ -310,32 +698,26 @@ class GraphSharePointClient(TeamsClient):
 
         # 2. Group by chat_id
         chat_groups = defaultdict(list)
-        # 將每個 item 的完整資訊加入對應的 chat_groups
         for item in notifications:
-            chat_groups[item.teams_group_id].append({
-                "uuid": item.uuid,
-                "owner_id": item.owner_id,
-                "msg_id": item.msg_id,
-                "task": item.task
-            })
-
-        # 3. Iterate each chat group and fetch messages once
-        for chat_id, items in chat_groups.items():
-            try:
-                messages = self.list_msg_in_chats(chat_id)
-            except Exception as e:
-                print(f"⚠️ Failed to fetch messages for chat {chat_id}: {e}")
+            chat_groups[item.teams_group_id].append(item)
+        # 找到的回覆依 (檔案, 工作表) 收集起來，最後每張工作表一次寫回
+        replies = defaultdict(list)
+
+        # 3. Scan the chats concurrently (bounded by SCAN_CONCURRENCY)
+        groups = list(chat_groups.items())
+        for (chat_id, _), found in zip(groups, threaded_map(self._scan_chat, groups, SCAN_CONCURRENCY)):
+            if isinstance(found, Exception):
+                print(f"⚠️ Failed to scan chat {chat_id}: {found}")
                 continue
+            for item, content in found:
+                key = (item.site_name, item.drive_name, item.file_path, item.sheet_name)
+                replies[key].append((item, content))
+                print(f"📝 Reply found for task {item.task}")
 
-            # 4. Search for replies matching user_id and msg_id in current chat
-            for item in items:
-                try:
-                    user_id = item['owner_id']
-                    for mid in item['msg_id']:
-                        content = self._search_message_reference(messages, user_id, mid)
-                        if content:
-                            self._write_cell(item['uuid'], content)
-                            print(f"📝 Replied content written for task {item['task']}")
-                            break  # only process first found reply
-                except Exception as e:
-                    print(f"❌ Error processing task {item['task']}: {e}")
\ No newline at end of file
+        # 4. Write the replies back, one workbook session per sheet
+        for (site_name, drive_name, file_path, sheet_name), sheet_replies in replies.items():
+            try:
+                client = self._client_for_file(site_name, drive_name, file_path)
+                client._write_replies(sheet_name, sheet_replies)
+            except Exception as e:
+                print(f"❌ Error writing replies to {unquote(file_path)} / {sheet_name}: {e}")
\ No newline at end of file
@@ -0,0 +1,70 @@
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# 狀態為這些值的任務不需要提醒
+SKIP_STATUSES = ["done", "n/a"]
+
+
+class SheetHit(NamedTuple):
+    row: int     # 0-based position of the flagged row in the sheet DataFrame
+    reason: str
+    field: str   # col_tag key of the offending cell, e.g. "owner"
+
+
+def _near_today(parsed, today):
+    """Mask of dates exactly one calendar-day difference (floor) away from today."""
+    return (parsed - today).dt.days.abs() == 1
+
+
+def evaluate_sheet_rules(df: pd.DataFrame, col_tag: dict, today=None) -> List[SheetHit]:
+    """
+    Evaluate the reminder rules over a whole sheet with column masks instead of per-row Python.
+
+    Rules, per task row (row 0 is the header row and is skipped):
+      - rows without a task, or with status done / n/a, are ignored
+      - missing owner, or an owner that is not an email, is reported alone
+      - otherwise a missing estimate start / due date, or one within one day of today, is reported
+    Hits are returned in sheet order, and in the rule order above within a row.
+    """
+    if today is None:
+        today = pd.Timestamp.now().normalize()
+    if len(df) <= 1:
+        return []
+
+    body = df.iloc[1:]
+    task = body.iloc[:, col_tag["task"]]
+    status = body.iloc[:, col_tag["status"]].astype(str).str.lower()
+    owner = body.iloc[:, col_tag["owner"]]
+
+    active = task.notna() & ~status.isin(SKIP_STATUSES)
+    owner_missing = active & owner.isna()
+    owner_invalid = active & owner.notna() & ~owner.astype(str).str.contains("@", regex=False)
+    owner_ok = active & owner.notna() & ~owner_invalid
+
+    rules = [
+        (owner_missing, "Owner is missing", "owner"),
+        (owner_invalid, "Owner is not valid email", "owner"),
+    ]
+    for key, missing_reason, near_reason in (
+        ("estimate_start_date", "Estimate start date is missing", "Estimated start date is within one day of today"),
+        ("due_date", "Due date is missing", "Due date is within one day of today"),
+    ):
+        raw = body.iloc[:, col_tag[key]]
+        parsed = pd.to_datetime(raw, errors="coerce", format="mixed")
+        rules.append((owner_ok & raw.isna(), missing_reason, key))
+        rules.append((owner_ok & raw.notna() & _near_today(parsed, today), near_reason, key))
+
+    rows, order = [], []
+    for rule_idx, (mask, _, _) in enumerate(rules):
+        positions = np.flatnonzero(mask.to_numpy(dtype=bool)) + 1  # +1: body 從第 1 列開始
+        rows.append(positions)
+        order.append(np.full(len(positions), rule_idx))
+    rows = np.concatenate(rows)
+    order = np.concatenate(order)
+    sort_idx = np.lexsort((order, rows))
+    return [
+        SheetHit(int(rows[i]), rules[order[i]][1], rules[order[i]][2])
+        for i in sort_idx
+    ]
@@ -17,21 +17,62 @@ logger = logging.getLogger(__name__)
 #         logger.error(f"notify_task：Notification failed for {notification_id}: {e}")
 
 import random
-MAX_NOTIFICATIONS_PER_BATCH = 2
-SLEEP_BETWEEN_BATCHES = 2  # 秒數，避免 hitting rate limit
+import requests
+from collections import defaultdict
+from django.conf import settings
+from core.rate_limit import retry_after_seconds
+from core.utils import threaded_map
+
+# 同一個聊天室、同一個 owner 的通知合併成一則訊息送出（需要 owner 依編號逐項回覆，預設關閉）
+NOTIFY_DIGEST = getattr(settings, 'REMINDERS_NOTIFY_DIGEST', False)
+# daemon_task 同時掃描幾個 host
+DAEMON_HOST_CONCURRENCY = getattr(settings, 'REMINDERS_DAEMON_HOST_CONCURRENCY', 2)
+
+def _retry_if_throttled(task, e, args=None):
+    # 發送速率由 GraphClient 的共用 token bucket 控制，429 也會先在 client 內依 Retry-After 重試；
+    # 走到這裡代表重試次數用完或 Retry-After 太長，交給 celery 稍後再排
+    if e.response is not None and e.response.status_code in (429, 503):
+        countdown = retry_after_seconds(e.response, default=random.randint(30, 60))
+        logger.warning(f"Rate limit hit. Retrying in {countdown:.0f} seconds.")
+        raise task.retry(exc=e, countdown=countdown, args=args)
+
 @shared_task(bind=True, max_retries=5)
 def notify_single_task(self, notification_id):
     try:
         notification = TaskNotification.objects.get(uuid=notification_id)
         sharepoint_client = GraphSharePointClient(notification.host_id)
         sharepoint_client.notify(notification)
+    except requests.HTTPError as e:
+        _retry_if_throttled(self, e)
+        logger.error(f"notify_task：Notification failed for {notification_id}: {e}")
     except Exception as e:
-        if "Too Many Requests" in str(e):  # 你也可以更精準用 API 回傳 code 判斷
-            countdown = random.randint(30, 60)  # 加上隨機退避避免擠在同一時間
-            logger.warning(f"Rate limit hit. Retrying in {countdown} seconds.")
-            self.retry(exc=e, countdown=countdown)
-        else:
-            logger.error(f"notify_task：Notification failed for {notification_id}: {e}")
+        logger.error(f"notify_task：Notification failed for {notification_id}: {e}")
+
+@shared_task(bind=True, max_retries=5)
+def notify_digest_task(self, host_id, notification_ids):
+    """
+    Send the notifications of one chat as one message per owner (see GraphSharePointClient.notify_digest).
+    On throttling only the notifications not sent yet are retried.
+    """
+    notifications = []
+    sent_before = {}
+    try:
+        notifications = list(
+            TaskNotification.objects.filter(uuid__in=notification_ids)
+            .exclude(status__in=TaskNotification.CLOSED_STATUSES)
+            .order_by("sheet_name", "row")
+        )
+        sent_before = {n.pk: len(n.msg_id) for n in notifications}
+        if notifications:
+            sent = GraphSharePointClient(host_id).notify_digest(notifications)
+            logger.info(f"notify_digest_task: {len(notifications)} notifications sent in {sent} messages")
+    except requests.HTTPError as e:
+        # notify_digest 只在訊息送出後才 append msg_id，沒變的就是還沒送的
+        remaining = [str(n.uuid) for n in notifications if len(n.msg_id) == sent_before[n.pk]]
+        _retry_if_throttled(self, e, args=(host_id, remaining))
+        logger.error(f"notify_digest_task failed for {len(notification_ids)} notifications: {e}")
+    except Exception as e:
+        logger.error(f"notify_digest_task failed for {len(notification_ids)} notifications: {e}")
 
 @shared_task
 def notify_task(uuid):
@@ -49,25 +90,43 @@ def notify_task(uuid):
             site_name=task.site_name,
             drive_name=task.drive_name,
             file_path=task.file_path,
-        ).exclude(status=TaskNotification.Status.COMPLETED)
+        ).exclude(status__in=TaskNotification.CLOSED_STATUSES)
 
-        for i, notification in enumerate(notifications):
-            notify_single_task.delay(notification.uuid) # type: ignore
+        if NOTIFY_DIGEST:
+            # 每個聊天室一個 celery task，裡面每個 owner 只發一則訊息
+            by_chat = defaultdict(list)
+            for notification in notifications:
+                by_chat[notification.teams_group_id].append(str(notification.uuid))
+            for notification_ids in by_chat.values():
+                notify_digest_task.delay(task.host_id, notification_ids) # type: ignore
+        else:
+            for i, notification in enumerate(notifications):
+                notify_single_task.delay(notification.uuid) # type: ignore
         task.last_notified_at = timezone.now()
         task.next_notify_time = task.last_notified_at + timedelta(minutes=task.notify_interval)
         task.save()
         logger.info(f"notification pushed {task.file_path}")
     except Exception as e:
         logger.error(f"notify_task failed for uuid {uuid}: {e}")
+def _scan_host(host_id):
+    start = time.perf_counter()
+    GraphSharePointClient(user_id=host_id).scanAnyMatchMsg()
+    return time.perf_counter() - start
+
 @shared_task 
 def daemon_task():
     """
     Background daemon that scans SharePoint messages for each unique host_id in TaskNotification.
     Scheduled using Celery Beat (e.g., via CrontabSchedule).
+    Hosts are scanned concurrently (REMINDERS_DAEMON_HOST_CONCURRENCY), and each host scans its
+    chats concurrently too; the shared Graph rate limiter keeps the total request rate in check.
     """
     # Get all distinct host_ids from TaskNotification
-    host_ids = TaskNotification.objects.values_list('host_id', flat=True).distinct()
-    for host_id in host_ids:
-        print(f"Running daemon scan for host_id: {host_id}")
-        client = GraphSharePointClient(user_id=host_id)
-        client.scanAnyMatchMsg()
\ No newline at end of file
+    host_ids = list(TaskNotification.objects.values_list('host_id', flat=True).distinct())
+    start = time.perf_counter()
+    for host_id, result in zip(host_ids, threaded_map(_scan_host, host_ids, DAEMON_HOST_CONCURRENCY)):
+        if isinstance(result, Exception):
+            logger.error(f"daemon_task: scan failed for host_id {host_id}: {result}")
+        else:
+            logger.info(f"daemon_task: host_id {host_id} scanned in {result:.2f}s")
+    logger.info(f"daemon_task: {len(host_ids)} hosts scanned in {time.perf_counter() - start:.2f}s")
@@ -1,3 +1,166 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+import pandas as pd
+
+from core.models import ChatMessage
+from .models import TaskNotification
+from .sharepoint_client import GraphSharePointClient, parse_numbered_replies
+from .sheet_rules import evaluate_sheet_rules
+
+COL_TAG = {
+    "status": 3, "task": 4, "owner": 5, "estimate_start_date": 6, "estimate_days": 7, "spent_days": 8,
+    "due_date": 9, "note": 10, "MR_link": 11, "teams_group_name": 12,
+}
+TODAY = pd.Timestamp("2026-03-10")
+
+
+def make_sheet(*rows):
+    """Sheet DataFrame like read_excel returns it: row 0 is the template's header row."""
+    data = [[None] * 13]
+    for values in rows:
+        row = [None] * 13
+        for key, value in values.items():
+            row[COL_TAG[key]] = value
+        data.append(row)
+    return pd.DataFrame(data, dtype=object)
+
+
+def ok_row(**values):
+    row = {
+        "task": "Feature", "owner": "someone@zyxel.com.tw",
+        "estimate_start_date": TODAY + pd.Timedelta(days=10), "due_date": TODAY + pd.Timedelta(days=20),
+    }
+    row.update(values)
+    return row
+
+
+def hits(df):
+    return [(hit.row, hit.reason, hit.field) for hit in evaluate_sheet_rules(df, COL_TAG, today=TODAY)]
+
 
 # Create your tests here.
+class EvaluateSheetRulesTests(SimpleTestCase):
+    def test_header_row_and_rows_without_task_are_skipped(self):
+        df = make_sheet(ok_row(task=None, owner=None))
+        df.iloc[0, COL_TAG["task"]] = "Task"
+        self.assertEqual(hits(df), [])
+
+    def test_done_and_na_statuses_are_skipped_case_insensitively(self):
+        df = make_sheet(ok_row(status="Done", owner=None), ok_row(status="N/A", owner=None), ok_row(status="WIP", owner=None))
+        self.assertEqual(hits(df), [(3, "Owner is missing", "owner")])
+
+    def test_owner_problems_are_reported_alone(self):
+        df = make_sheet(
+            ok_row(owner=None, estimate_start_date=None, due_date=None),
+            ok_row(owner="someone", estimate_start_date=None, due_date=None),
+        )
+        self.assertEqual(hits(df), [
+            (1, "Owner is missing", "owner"),
+            (2, "Owner is not valid email", "owner"),
+        ])
+
+    def test_missing_dates_are_reported_in_rule_order(self):
+        df = make_sheet(ok_row(estimate_start_date=None, due_date=None))
+        self.assertEqual(hits(df), [
+            (1, "Estimate start date is missing", "estimate_start_date"),
+            (1, "Due date is missing", "due_date"),
+        ])
+
+    def test_dates_one_calendar_day_away_are_reported(self):
+        # 與原本逐列的 abs((date - today).days) == 1 相同：timedelta.days 向下取整
+        cases = {
+            TODAY - pd.Timedelta(hours=12): True,
+            TODAY - pd.Timedelta(days=1): True,
+            TODAY: False,
+            TODAY + pd.Timedelta(hours=12): False,
+            TODAY + pd.Timedelta(days=1): True,
+            TODAY + pd.Timedelta(hours=47): True,
+            TODAY + pd.Timedelta(days=2): False,
+            TODAY - pd.Timedelta(days=2): False,
+        }
+        df = make_sheet(*[ok_row(due_date=date) for date in cases])
+        expected = [
+            (row, "Due date is within one day of today", "due_date")
+            for row, near in enumerate(cases.values(), start=1) if near
+        ]
+        self.assertEqual(hits(df), expected)
+
+    def test_date_strings_are_parsed_and_unparseable_values_are_ignored(self):
+        df = make_sheet(
+            ok_row(estimate_start_date="2026-03-11"),
+            ok_row(estimate_start_date="tbd"),
+        )
+        self.assertEqual(hits(df), [
+            (1, "Estimated start date is within one day of today", "estimate_start_date"),
+        ])
+
+    def test_sheet_with_only_a_header_has_no_hits(self):
+        self.assertEqual(hits(make_sheet()), [])
+
+
+class ParseNumberedRepliesTests(SimpleTestCase):
+    def test_numbered_lines_in_supported_formats(self):
+        self.assertEqual(
+            parse_numbered_replies("#1 done\n#2: next week\n3: blocked\n4. N/A\n5：好\n#6 - later"),
+            {1: "done", 2: "next week", 3: "blocked", 4: "N/A", 5: "好", 6: "later"},
+        )
+
+    def test_unnumbered_text_is_ignored_or_continues_the_previous_answer(self):
+        self.assertEqual(
+            parse_numbered_replies("thanks!\n#2 waiting on QA\nshould be fixed Friday\n\n#10 ok"),
+            {2: "waiting on QA should be fixed Friday", 10: "ok"},
+        )
+
+    def test_plain_reply_has_no_answers(self):
+        self.assertEqual(parse_numbered_replies("ok"), {})
+        self.assertEqual(parse_numbered_replies("#3"), {})
+        self.assertEqual(parse_numbered_replies(None), {})
+
+
+class ScanChatDigestTests(TestCase):
+    def setUp(self):
+        common = dict(
+            host_id="host", site_name="site", drive_name="drive", file_path="file", sheet_name="Sheet",
+            teams_group_id="chat", teams_group_name="group", task="Feature",
+            owner_id="owner", owner_email="owner@zyxel.com.tw", owner_name="Owner",
+        )
+        self.items = [
+            TaskNotification.objects.create(row=row, reason=f"reason {row}", field_address=f"F{row}", **common)
+            for row in (3, 4, 5)
+        ]
+        self.client = GraphSharePointClient.__new__(GraphSharePointClient)
+        self.client.sync_chat_messages = lambda chat_id: 0
+        self.sent = []
+        self.client.send_message_to_chat = lambda chat_id, payload: self.sent.append(payload) or f"msg{len(self.sent)}"
+
+    def reply(self, reference_id, text, sender_id="owner", message_id=None):
+        ChatMessage.objects.create(
+            chat_id="chat", message_id=message_id or f"reply{ChatMessage.objects.count()}", sender_id=sender_id,
+            created=timezone.now(), reference_id=reference_id, text=text,
+        )
+
+    def scan(self):
+        items = list(TaskNotification.objects.order_by("row"))
+        return sorted((item.row, text) for item, text in self.client._scan_chat(("chat", items)))
+
+    def test_digest_records_each_item_position(self):
+        self.assertEqual(self.client.notify_digest(self.items), 1)
+        positions = [n.digest_positions for n in TaskNotification.objects.order_by("row")]
+        self.assertEqual(positions, [{"msg1": 1}, {"msg1": 2}, {"msg1": 3}])
+
+    def test_unnumbered_reply_to_a_digest_is_not_applied_to_any_item(self):
+        self.client.notify_digest(self.items)
+        self.reply("msg1", "ok")
+        self.assertEqual(self.scan(), [])
+
+    def test_each_item_only_takes_its_own_numbered_answer(self):
+        self.client.notify_digest(self.items)
+        self.reply("msg1", "#1 done")
+        self.reply("msg1", "#3 next sprint")
+        self.reply("msg1", "#2 not me", sender_id="someone else")
+        self.assertEqual(self.scan(), [(3, "done"), (5, "next sprint")])
+
+    def test_reply_to_a_single_item_message_is_taken_whole(self):
+        self.client.notify_digest(self.items[:1])
+        self.reply("msg1", "done\nsee MR")
+        self.assertEqual(self.scan(), [(3, "done see MR")])
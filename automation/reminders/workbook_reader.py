@@ -0,0 +1,132 @@
+import datetime
+from io import BytesIO
+from typing import Iterator, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Excel 日期序號的起點（1900 date system，含 1900/2/29 bug）
+EXCEL_EPOCH = "1899-12-30"
+
+ENGINES = ("openpyxl", "calamine")
+
+
+def _is_blank(value):
+    return value is None or value == ""
+
+
+def _chunk_frame(rows, first_col, serial_date_cols):
+    """One block of body rows as an object DataFrame with positional columns, "" as NaN."""
+    df = pd.DataFrame([[None] * first_col + list(row) for row in rows], dtype=object)
+    df = df.replace("", float("nan"))
+    for idx in serial_date_cols:
+        if idx >= df.shape[1]:
+            continue
+        col = df.iloc[:, idx].copy()
+        serial = col.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and not pd.isna(v))
+        if serial.any():
+            col[serial] = list(pd.to_datetime(col[serial].astype(float), unit="D", origin=EXCEL_EPOCH))
+            df.isetitem(idx, col)
+    return df
+
+
+def frame_from_chunks(chunks, first_col=0, serial_date_cols=()):
+    """
+    Build a read_excel-like DataFrame from successive blocks of rows of cell values that start at
+    column first_col. Each block is converted as soon as it arrives, so only one block of raw
+    values is held at a time.
+
+    The first row of the first block is the header, columns before first_col are kept as empty
+    columns so absolute column positions (col_tag) still line up, empty cells become NaN and
+    trailing blank rows are dropped. Numbers in serial_date_cols are Excel date serials and are
+    converted to datetimes.
+    """
+    header, frames = None, []
+    for rows in chunks:
+        rows = list(rows)
+        if header is None:
+            if not rows:
+                continue
+            header, rows = [None] * first_col + list(rows[0]), rows[1:]
+        if rows:
+            frames.append(_chunk_frame(rows, first_col, serial_date_cols))
+    if header is None:
+        return pd.DataFrame()
+
+    columns = [f"Unnamed: {i}" if _is_blank(v) else v for i, v in enumerate(header)]
+    if not frames:
+        return pd.DataFrame(columns=columns, dtype=object)
+    df = pd.concat(frames, ignore_index=True)
+    # 與 read_excel 相同，結尾的空白列不算資料（只能在全部讀完後判斷，中間的空白列要保留）
+    filled = df.notna().any(axis=1).to_numpy()
+    df = df.iloc[:filled.nonzero()[0][-1] + 1 if filled.any() else 0]
+    df.columns = columns
+    return df
+
+
+def frame_from_rows(rows, first_col=0, serial_date_cols=()):
+    """frame_from_chunks for rows that are already in one block."""
+    return frame_from_chunks([rows], first_col, serial_date_cols)
+
+
+def _select_sheets(available, sheet_name):
+    if sheet_name is None:
+        return list(available)
+    names = [sheet_name] if isinstance(sheet_name, str) else list(sheet_name)
+    for name in names:
+        if name not in available:
+            raise ValueError(f"Worksheet named '{name}' not found")
+    return names
+
+
+def _iter_openpyxl(content, sheet_name, first_col, last_col):
+    # read_only 模式逐列串流，不會把整本活頁簿的 cell 物件都建起來
+    wb = load_workbook(BytesIO(content), read_only=True, data_only=True, keep_links=False)
+    try:
+        for name in _select_sheets(wb.sheetnames, sheet_name):
+            ws = wb[name]
+            ws.reset_dimensions()  # 有些檔案的 dimension 記錄不正確，改成實際讀到哪算哪
+            rows = ws.iter_rows(min_row=1, min_col=first_col + 1, max_col=last_col + 1, values_only=True)
+            yield name, frame_from_rows(rows, first_col)
+    finally:
+        wb.close()
+
+
+def _iter_calamine(content, sheet_name, first_col, last_col):
+    from python_calamine import CalamineWorkbook
+
+    width = last_col - first_col + 1
+    wb = CalamineWorkbook.from_filelike(BytesIO(content))
+    for name in _select_sheets(wb.sheet_names, sheet_name):
+        rows = []
+        for row in wb.get_sheet_by_name(name).to_python(skip_empty_area=False):
+            # calamine 對純日期 cell 回傳 date，統一成 read_excel 的 datetime
+            cells = [datetime.datetime.combine(v, datetime.time()) if type(v) is datetime.date else v
+                     for v in row[first_col:last_col + 1]]
+            rows.append(cells + [None] * (width - len(cells)))
+        yield name, frame_from_rows(rows, first_col)
+
+
+def resolve_engine(engine="auto"):
+    """auto 會在有安裝 python-calamine 時使用它，否則退回 openpyxl"""
+    if engine != "auto":
+        if engine not in ENGINES:
+            raise ValueError(f"Unsupported xlsx engine: {engine}")
+        return engine
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return "openpyxl"
+    return "calamine"
+
+
+def iter_xlsx_sheets(content: bytes, sheet_name, first_col, last_col,
+                     engine="auto") -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Lazily yield (sheet name, DataFrame) for the selected sheets of an xlsx file, one sheet at a
+    time, parsing only columns first_col..last_col (0-based, inclusive).
+
+    sheet_name follows read_excel: a name, a list of names, or None for every sheet.
+    """
+    reader = _iter_calamine if resolve_engine(engine) == "calamine" else _iter_openpyxl
+    return reader(content, sheet_name, first_col, last_col)